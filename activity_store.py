@@ -0,0 +1,325 @@
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DAY_FORMAT = "%Y-%m-%d"
+
+# Event kinds recorded by the bot
+START, PHONE, UPLOAD, REPORT = "start", "phone", "upload", "report"
+
+
+class ActivityStore(abc.ABC):
+    """User activity with buffered writes.
+
+    Three tables are kept: `user_activity` (usage count, phone number and last use
+    per user), `activity_events` (every interaction, indexed by time) and
+    `activity_daily` (event counts per day, user and kind, maintained on write so
+    aggregate queries never scan events). `record` and `record_event` only update
+    in-memory buffers; `flush` writes everything buffered in one transaction.
+    A `bot_state` table holds serialized bot state (see persistence.py).
+    Subclasses provide the connection and SQL dialect.
+    """
+
+    placeholder = "?"
+    batch_size = 1000
+
+    def __init__(self):
+        self._pending = {}  # username -> [usage count, phone number, last used]
+        self._events = []  # (username, event, time)
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _connection(self):
+        """Context manager yielding a connection that commits on success and rolls back on error."""
+
+    def _cursor(self, conn, stream: bool = False):
+        return conn.cursor()
+
+    def _timestamp(self, value: datetime):
+        """Database representation of a point in time."""
+        return value
+
+    def _day(self, value: date):
+        """Database representation of a day."""
+        return value
+
+    def _sql(self, statement: str) -> str:
+        return statement.replace("?", self.placeholder)
+
+    def setup(self) -> None:
+        """Create the tables and their indexes if needed."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            for statement in self._schema:
+                cursor.execute(statement)
+            cursor.execute("CREATE INDEX IF NOT EXISTS user_activity_last_used ON user_activity (last_used)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS activity_events_created_at ON activity_events (created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS activity_events_user ON activity_events (username, created_at)")
+
+    def record(self, username: str, phone_number: str = None, when: datetime = None, event: str = START) -> None:
+        """Count a use of the bot by `username` and log it as an event."""
+        when = when or datetime.now().replace(microsecond=0)
+        with self._lock:
+            entry = self._pending.setdefault(username, [0, None, None])
+            entry[0] += 1
+            if phone_number:
+                entry[1] = phone_number
+            entry[2] = when
+            self._events.append((username, event, when))
+
+    def record_event(self, username: str, event: str, when: datetime = None) -> None:
+        """Log an interaction without counting it as a use (e.g. an upload or a finished report)."""
+        with self._lock:
+            self._events.append((username, event, when or datetime.now().replace(microsecond=0)))
+
+    def flush(self) -> int:
+        """Write buffered activity; returns the number of events written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, []
+        if not pending and not events:
+            return 0
+        users = [(username, count, phone, self._timestamp(last_used)) for username, (count, phone, last_used) in pending.items()]
+        daily = Counter((when.date(), username, event) for username, event, when in events)
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(self._sql(
+                    "INSERT INTO user_activity (username, usage_count, phone_number, last_used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (username) DO UPDATE SET "
+                    "usage_count = user_activity.usage_count + excluded.usage_count, "
+                    "phone_number = COALESCE(excluded.phone_number, user_activity.phone_number), "
+                    "last_used = excluded.last_used"
+                ), users)
+                cursor.executemany(self._sql(
+                    "INSERT INTO activity_events (username, event, created_at) VALUES (?, ?, ?)"
+                ), [(username, event, self._timestamp(when)) for username, event, when in events])
+                cursor.executemany(self._sql(
+                    "INSERT INTO activity_daily (day, username, event, count) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (day, username, event) DO UPDATE SET count = activity_daily.count + excluded.count"
+                ), [(self._day(day), username, event, count) for (day, username, event), count in daily.items()])
+        except Exception:
+            # Put the batch back so it is retried on the next flush
+            with self._lock:
+                for username, (count, phone, last_used) in pending.items():
+                    entry = self._pending.setdefault(username, [0, None, last_used])
+                    entry[0] += count
+                    entry[1] = entry[1] or phone
+                self._events[:0] = events
+            raise
+        return len(events)
+
+    def _iterate(self, statement: str, params):
+        """Yield result rows in batches without loading the whole result."""
+        with self._connection() as conn:
+            cursor = self._cursor(conn, stream=True)
+            cursor.execute(self._sql(statement), params)
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def _range(self, column: str, start, end, convert, username: str = None):
+        """WHERE conditions and params for start <= column < end (and the user, if given)."""
+        conditions, params = [], []
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(convert(start))
+        if end is not None:
+            conditions.append(f"{column} < ?")
+            params.append(convert(end))
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        return conditions, params
+
+    def iter_users(self, start: datetime = None, end: datetime = None, username: str = None):
+        """(username, usage_count, phone_number, last_used) rows, last used in [start, end)."""
+        conditions, params = self._range("last_used", start, end, self._timestamp, username)
+        statement = "SELECT username, usage_count, phone_number, last_used FROM user_activity WHERE " + " AND ".join(
+            ["last_used IS NOT NULL"] + conditions) + " ORDER BY last_used"
+        for username, count, phone, last_used in self._iterate(statement, params):
+            yield username, count, phone, str(last_used)
+
+    def iter_events(self, start: datetime = None, end: datetime = None, username: str = None):
+        """(created_at, username, event) rows in time order, created in [start, end)."""
+        conditions, params = self._range("created_at", start, end, self._timestamp, username)
+        statement = "SELECT created_at, username, event FROM activity_events"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY created_at"
+        for created_at, username, event in self._iterate(statement, params):
+            yield str(created_at), username, event
+
+    def iter_daily(self, start: date = None, end: date = None, username: str = None):
+        """(day, event, count) rows from the daily rollup for days in [start, end)."""
+        conditions, params = self._range("day", start, end, self._day, username)
+        statement = "SELECT day, event, SUM(count) FROM activity_daily"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " GROUP BY day, event ORDER BY day, event"
+        for day, event, count in self._iterate(statement, params):
+            yield str(day), event, int(count)
+
+    def iter_user_totals(self, start: date = None, end: date = None, username: str = None):
+        """(username, event, count) rows from the daily rollup for days in [start, end)."""
+        conditions, params = self._range("day", start, end, self._day, username)
+        statement = "SELECT username, event, SUM(count) FROM activity_daily"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " GROUP BY username, event ORDER BY username, event"
+        for username, event, count in self._iterate(statement, params):
+            yield username, event, int(count)
+
+    def load_state(self, kind: str) -> dict:
+        """{key: value bytes} of the saved bot state of one kind."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("SELECT key, value FROM bot_state WHERE kind = ?"), (kind,))
+            return {key: bytes(value) for key, value in cursor.fetchall()}
+
+    def load_state_value(self, kind: str, key: str):
+        """Value bytes of one saved bot state entry, or None if there is none."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("SELECT value FROM bot_state WHERE kind = ? AND key = ?"), (kind, key))
+            row = cursor.fetchone()
+            return None if row is None else bytes(row[0])
+
+    def save_state(self, kind: str, key: str, value: bytes = None) -> None:
+        """Store one bot state value; None deletes it."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            if value is None:
+                cursor.execute(self._sql("DELETE FROM bot_state WHERE kind = ? AND key = ?"), (kind, key))
+            else:
+                cursor.execute(self._sql(
+                    "INSERT INTO bot_state (kind, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (kind, key) DO UPDATE SET value = excluded.value"
+                ), (kind, key, value))
+
+    def migrate_json(self, path: str) -> int:
+        """One-time import of the old user_activity.json; the file is renamed afterwards."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as file:
+            activity = json.load(file)
+        rows = []
+        for username, details in activity.items():
+            last_used = details.get("last_used")
+            last_used = self._timestamp(datetime.strptime(last_used, TIME_FORMAT)) if last_used else None
+            rows.append((username, details.get("usage_count", 0), details.get("phone_number"), last_used))
+        with self._connection() as conn:
+            conn.cursor().executemany(self._sql(
+                "INSERT INTO user_activity (username, usage_count, phone_number, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (username) DO NOTHING"
+            ), rows)
+        os.replace(path, path + ".migrated")
+        logger.info(f"Migrated {len(rows)} users from {path}")
+        return len(rows)
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SQLiteActivityStore(ActivityStore):
+    """Activity store in a local SQLite file, for local runs."""
+
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS user_activity ("
+        "username TEXT PRIMARY KEY, usage_count INTEGER NOT NULL DEFAULT 0, phone_number TEXT, last_used TEXT)",
+        "CREATE TABLE IF NOT EXISTS activity_events ("
+        "id INTEGER PRIMARY KEY, username TEXT NOT NULL, event TEXT NOT NULL, created_at TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS activity_daily ("
+        "day TEXT NOT NULL, username TEXT NOT NULL, event TEXT NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (day, username, event))",
+        "CREATE TABLE IF NOT EXISTS bot_state ("
+        "kind TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (kind, key))",
+    )
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # Commits, or rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    # Fixed-width text keeps index order equal to time order
+    def _timestamp(self, value: datetime):
+        return value.strftime(TIME_FORMAT)
+
+    def _day(self, value: date):
+        return value.strftime(DAY_FORMAT)
+
+
+class PostgresActivityStore(ActivityStore):
+    """Activity store in PostgreSQL, using a thread-safe connection pool."""
+
+    placeholder = "%s"
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS user_activity ("
+        "username TEXT PRIMARY KEY, usage_count INTEGER NOT NULL DEFAULT 0, phone_number TEXT, last_used TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS activity_events ("
+        "id BIGSERIAL PRIMARY KEY, username TEXT NOT NULL, event TEXT NOT NULL, created_at TIMESTAMP NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS activity_daily ("
+        "day DATE NOT NULL, username TEXT NOT NULL, event TEXT NOT NULL, count INTEGER NOT NULL, "
+        "PRIMARY KEY (day, username, event))",
+        "CREATE TABLE IF NOT EXISTS bot_state ("
+        "kind TEXT NOT NULL, key TEXT NOT NULL, value BYTEA NOT NULL, PRIMARY KEY (kind, key))",
+    )
+
+    def __init__(self, dsn: str, max_connections: int = 4):
+        super().__init__()
+        self.dsn = dsn
+        self.max_connections = max_connections
+        self._pool = None
+
+    @contextmanager
+    def _connection(self):
+        if self._pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            self._pool = ThreadedConnectionPool(1, self.max_connections, self.dsn)
+        conn = self._pool.getconn()
+        try:
+            with conn:  # Commits, or rolls back on error
+                yield conn
+        finally:
+            self._pool.putconn(conn)
+
+    def _cursor(self, conn, stream: bool = False):
+        # A named (server-side) cursor sends rows in batches instead of all at once
+        if stream:
+            cursor = conn.cursor(name=f"activity_stream_{threading.get_ident()}")
+            cursor.itersize = self.batch_size
+            return cursor
+        return conn.cursor()
+
+    def close(self) -> None:
+        super().close()
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+
+def open_activity_store() -> ActivityStore:
+    """PostgreSQL when DATABASE_URL is set (as on Heroku), otherwise SQLite at ACTIVITY_DB."""
+    database_url = os.environ.get("DATABASE_URL")
+    if database_url:
+        return PostgresActivityStore(database_url, int(os.environ.get("DATABASE_POOL_SIZE", 4)))
+    return SQLiteActivityStore(os.environ.get("ACTIVITY_DB", "user_activity.db"))
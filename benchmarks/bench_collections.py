@@ -0,0 +1,72 @@
+"""Microbenchmark: CollectionMatcher against the original per-row find_feature scan.
+
+Run from the repository root:
+    python benchmarks/bench_collections.py --rows 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collection_matcher import CollectionMatcher  # noqa: E402
+from orders import FEATURES  # noqa: E402
+
+
+def find_feature(text):
+    """The original implementation from process_file."""
+    for feature in FEATURES:
+        if pd.notna(text) and feature in text:
+            return feature
+    return "No Match"
+
+
+def make_names(rows: int, seed: int = 0) -> pd.Series:
+    rng = random.Random(seed)
+    words = ['Ламинат', 'Kronotex', 'Дуб', 'Орех', '33 класс', '8мм', '1380x193', 'AC5', 'Mammut']
+    names = []
+    for i in range(rows):
+        parts = rng.sample(words, 4)
+        # Most names carry one code, some two (priority matters), some none
+        for _ in range(rng.choice([0, 1, 1, 1, 2])):
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(FEATURES))
+        names.append(f"{' '.join(parts)} {i}")
+    return pd.Series(names)
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    names = make_names(args.rows)
+    matcher = CollectionMatcher(FEATURES)
+
+    expected = names.apply(find_feature)
+    result = matcher.classify(names)
+    if not expected.equals(result):
+        raise SystemExit("CollectionMatcher result differs from find_feature")
+
+    legacy = best_of(lambda: names.apply(find_feature), args.repeat)
+    compiled = best_of(lambda: matcher.classify(names), args.repeat)
+    print(f"rows={args.rows} features={len(FEATURES)}")
+    print(f"find_feature .apply:        {legacy * 1000:8.1f} ms")
+    print(f"CollectionMatcher.classify: {compiled * 1000:8.1f} ms  ({legacy / compiled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
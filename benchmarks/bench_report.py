@@ -0,0 +1,95 @@
+"""Benchmark: report.write_report against the original pandas/to_excel report block.
+
+Each measurement runs in a fresh process so peak RSS is not shared between runs.
+Run from the repository root:
+    python benchmarks/bench_report.py --rows 10000 50000 200000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orders import FEATURES, compute_orders  # noqa: E402
+from report import write_report  # noqa: E402
+
+
+def legacy_report(data1: pd.DataFrame, output) -> None:
+    """The original report block from process_file."""
+    data1 = data1.copy()
+    data1['В Пути'] = 0
+    data1['Рекомендательный Заказ'] = 'helper - on_the_way'
+    purchase_df = data1[['Артикул ', 'Номенклатура', 'Коллекция', 'helper', 'В Пути', 'Рекомендательный Заказ']]
+    overstock_df = data1[['Артикул ', 'Номенклатура', 'Коллекция', 'overstock']]
+    outofstock_df = data1[['Артикул ', 'Номенклатура', 'outofstock']].copy()
+    outofstock_df['USD of outofstock'] = ''
+    on_the_way = pd.DataFrame(columns=['Артикул ', 'Номенклатура', 'В Пути'])
+
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        purchase_df.to_excel(writer, sheet_name='Рекомендательный Заказ', index=False)
+        overstock_df.to_excel(writer, sheet_name='Overstock', index=False)
+        outofstock_df.to_excel(writer, sheet_name='OutOfStock', index=False)
+        on_the_way.to_excel(writer, sheet_name='В Пути', index=False)
+        worksheet = writer.sheets['OutOfStock']
+        worksheet.write('E1', 1)
+        worksheet1 = writer.sheets["Рекомендательный Заказ"]
+        for row_num in range(1, len(outofstock_df) + 1):
+            worksheet.write_formula(row_num, 3, f'=C{row_num + 1}*$E$1')
+        for row_num in range(1, len(purchase_df) + 1):
+            worksheet1.write_formula(row_num, 5, f'=MAX(D{row_num + 1} - E{row_num + 1}, 0)')
+        for row_num in range(1, len(purchase_df) + 1):
+            worksheet1.write_formula(row_num - 1, 4, f'=iferror(VLOOKUP(A{row_num}, \'В Пути\'!A:C, 3, FALSE),0)')
+
+
+WRITERS = {"legacy": legacy_report, "write_report": write_report}
+
+
+def make_orders(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'Артикул ': [str(100000 + i) for i in range(rows)],
+        'Номенклатура': [f"Ламинат {FEATURES[i % len(FEATURES)]} Дуб 8мм {i}" for i in range(rows)],
+        'Дней на распродажи': rng.integers(-1, 400, rows),
+        'Остаток на конец': rng.uniform(0, 300, rows).round(2),
+        'Средние продажи день': rng.uniform(0, 5, rows).round(3),
+        'Прошло дней от последней продажи': rng.integers(-1, 200, rows),
+    })
+    data['Коллекция'] = [FEATURES[i % len(FEATURES)] for i in range(rows)]
+    return compute_orders(data, 30)
+
+
+def measure(writer: str, rows: int) -> None:
+    data = make_orders(rows)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    output = BytesIO()
+    WRITERS[writer](data, output)
+    elapsed = time.perf_counter() - start
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+    print(f"{writer:>12} rows={rows:>7} time={elapsed:7.2f}s peak_rss_growth={peak:7.1f} MiB size={len(output.getvalue()) / 2**20:.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--writer", choices=WRITERS)
+    args = parser.parse_args()
+
+    if args.writer:
+        for rows in args.rows:
+            measure(args.writer, rows)
+        return
+    for rows in args.rows:
+        for writer in WRITERS:
+            subprocess.run([sys.executable, __file__, "--writer", writer, "--rows", str(rows)], check=True)
+
+
+if __name__ == "__main__":
+    main()
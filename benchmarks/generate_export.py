@@ -0,0 +1,83 @@
+"""Generate synthetic 1C-style stock exports for benchmarks.
+
+The file looks like a real export: a header row, two preamble rows, the SKU rows
+and a two-row footer. Day counts are space-formatted text ('1 234'), SKUs without
+sales have '∞' days, a few articles carry the '-Н' suffix and most names contain
+a collection code. Run from the repository root:
+    python benchmarks/generate_export.py --rows 50000 -o export_50k.xlsx
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import xlsxwriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orders import FEATURES  # noqa: E402
+
+COLUMNS = ['Артикул ', 'Номенклатура', 'Ед. изм.', 'Остаток на начало', 'Приход', 'Расход',
+           'Остаток на конец', 'Средние продажи день', 'Дней на распродажи',
+           'Прошло дней от последней продажи', 'Дата последней продажи']
+
+PRODUCTS = ['Ламинат', 'Плинтус', 'Подложка', 'Порог', 'Панель']
+WOODS = ['Дуб', 'Орех', 'Ясень', 'Сосна', 'Бук', 'Клен']
+BRANDS = ['Kronotex', 'Kastamonu', 'Egger', 'Classen', 'Floorpan']
+
+
+def spaced(number: int) -> str:
+    """Format an integer the way 1C does: '12 345'."""
+    return f"{number:,}".replace(",", " ")
+
+
+def generate_export(output, rows: int, seed: int = 0, warehouse: str = 'Основной склад') -> None:
+    """Write an export with `rows` SKU rows of `warehouse` to `output` (file name or binary file object)."""
+    rng = np.random.default_rng(seed)
+    stock = rng.gamma(1.5, 60, rows).round(0)
+    daily_sales = np.where(rng.random(rows) < 0.15, 0, rng.gamma(1.2, 1.5, rows)).round(3)
+    days_to_sell = np.where(daily_sales > 0, np.ceil(stock / np.maximum(daily_sales, 1e-9)), -1).astype(int)
+    days_since_sale = np.where(rng.random(rows) < 0.05, -1, rng.integers(0, 2000, rows))
+    incoming = rng.integers(0, 200, rows)
+    outgoing = (daily_sales * 30).round(0)
+    codes = rng.integers(0, len(FEATURES) + 4, rows)  # Codes past the list mean "no collection"
+    special = rng.random(rows) < 0.03
+
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('TDSheet')
+    worksheet.write_row(0, 0, COLUMNS)
+    worksheet.write_row(1, 0, [f'Склад: {warehouse}'])
+    worksheet.write_row(2, 0, ['Период: 01.01.2024 - 31.12.2024'])
+
+    for i in range(rows):
+        code = FEATURES[codes[i]] + ' ' if codes[i] < len(FEATURES) else ''
+        article = f"{100000 + i}-Н" if special[i] else (100000 + i if i % 2 else f"KS-{100000 + i}")
+        name = (f"{PRODUCTS[i % len(PRODUCTS)]} {BRANDS[i % len(BRANDS)]} {code}"
+                f"{WOODS[i % len(WOODS)]} {8 + i % 5}мм арт.{i}")
+        worksheet.write_row(i + 3, 0, [
+            article, name, 'м2',
+            float(stock[i] + outgoing[i] - incoming[i]), int(incoming[i]), float(outgoing[i]),
+            float(stock[i]), float(daily_sales[i]),
+            spaced(days_to_sell[i]) if days_to_sell[i] >= 0 else '∞',
+            spaced(days_since_sale[i]) if days_since_sale[i] >= 0 else '∞',
+            f"{1 + i % 28:02d}.{1 + i % 12:02d}.2024",
+        ])
+
+    worksheet.write_row(rows + 3, 0, ['Итого', None, None, None, int(incoming.sum()), float(outgoing.sum()), float(stock.sum())])
+    worksheet.write_row(rows + 4, 0, ['Ответственный: ____________'])
+    workbook.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="default: export_<rows>.xlsx")
+    args = parser.parse_args()
+    output = args.output or f"export_{args.rows}.xlsx"
+    generate_export(output, args.rows, args.seed)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark each stage of the processing pipeline on synthetic exports.
+
+Stages, in pipeline order:
+    parse       ingest.read_export: streaming read of the needed columns (parsing and cleaning)
+    classify    orders.add_collections
+    compute     orders.compute_orders
+    write       report.write_report
+    read_excel  pd.read_excel of the whole sheet (the old parse path)
+    clean       orders.clean_export on the read_excel frame (the old cleaning path)
+
+Each stage is timed (best of --repeat) and then run once more under tracemalloc
+for its peak allocation. Results are saved as JSON; --compare prints the change
+against an earlier run. Run from the repository root:
+    python benchmarks/run.py --rows 1000 10000 100000 -o results.json
+    python benchmarks/run.py --rows 1000 10000 100000 --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_export import generate_export  # noqa: E402
+from ingest import read_export  # noqa: E402
+from orders import add_collections, clean_export, compute_orders  # noqa: E402
+from report import write_report  # noqa: E402
+
+DAYS = 30
+
+
+def _write(state):
+    output = BytesIO()
+    write_report(state["computed"], output)
+    return output
+
+
+# stage -> (state key it produces, prerequisite stages, function of the state)
+STAGES = {
+    "parse": ("parsed", [], lambda state: read_export(state["path"])),
+    "classify": ("classified", ["parse"], lambda state: add_collections(state["parsed"])),
+    "compute": ("computed", ["classify"], lambda state: compute_orders(state["classified"], DAYS)),
+    "write": ("report", ["compute"], _write),
+    "read_excel": ("raw", [], lambda state: pd.read_excel(state["path"])),
+    "clean": ("cleaned", ["read_excel"], lambda state: clean_export(state["raw"])),
+}
+
+
+def _size(value) -> int:
+    if isinstance(value, BytesIO):
+        return len(value.getbuffer())
+    return len(value)
+
+
+def run_stage(stage: str, state: dict, repeat: int) -> dict:
+    key, _, func = STAGES[stage]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        state[key] = func(state)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func(state)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    return {"stage": stage, "seconds": round(min(timings), 4), "peak_mib": round(peak / 2**20, 2), "output_size": _size(state[key])}
+
+
+def run_size(rows: int, stages: list, repeat: int, directory: str) -> list:
+    path = os.path.join(directory, f"export_{rows}.xlsx")
+    if not os.path.exists(path):
+        generate_export(path, rows)
+    state = {"path": path}
+    done, results = set(), []
+
+    def ensure(stage, measure):
+        if stage in done:
+            return
+        for prerequisite in STAGES[stage][1]:
+            ensure(prerequisite, prerequisite in stages)
+        if measure:
+            result = run_stage(stage, state, repeat)
+            result.update(rows=rows, input_bytes=os.path.getsize(path))
+            results.append(result)
+            print(f"rows={rows:>7} {stage:>10} {result['seconds']:9.3f}s {result['peak_mib']:9.1f} MiB peak")
+        else:
+            key, _, func = STAGES[stage]
+            state[key] = func(state)
+        done.add(stage)
+
+    for stage in stages:
+        ensure(stage, True)
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(results: list, baseline_path: str) -> None:
+    with open(baseline_path) as file:
+        baseline = {(result["rows"], result["stage"]): result for result in json.load(file)["results"]}
+    print(f"\nChange against {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["rows"], result["stage"]))
+        if old is None:
+            continue
+        time_change = (result["seconds"] / old["seconds"] - 1) * 100 if old["seconds"] else 0.0
+        memory_change = (result["peak_mib"] / old["peak_mib"] - 1) * 100 if old["peak_mib"] else 0.0
+        print(f"rows={result['rows']:>7} {result['stage']:>10} time {time_change:+7.1f}%  peak memory {memory_change:+7.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--data-dir", help="where generated exports are kept between runs (default: a temp dir)")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="earlier results to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.data_dir or temporary
+        os.makedirs(directory, exist_ok=True)
+        results = []
+        for rows in args.rows:
+            results.extend(run_size(rows, args.stages, args.repeat, directory))
+
+    with open(args.output, "w") as file:
+        json.dump({"meta": metadata(), "results": results}, file, indent=2)
+    print(f"Saved {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
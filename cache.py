@@ -0,0 +1,62 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def content_hash(data: bytes) -> str:
+    """Key for cached uploads: SHA-256 of the file content."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache:
+    """Least-recently-used cache with a size limit, per-entry TTL and hit/miss counters.
+
+    Size is counted in entries, or in `sizeof(value)` units when `sizeof` is given
+    (e.g. bytes of a finished report). Expired entries are dropped on access.
+    """
+
+    def __init__(self, max_size: int, ttl: float, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, value) -> None:
+        size = self._sizeof(value)
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_size:
+            return  # Would evict everything else and still not fit
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while self.size > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "size": self.size, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
@@ -0,0 +1,164 @@
+"""Command line interface for the order calculation, without the Telegram bot.
+
+    python cli.py process export.xlsx --days 30 --laminate 0.8 -o out.xlsx
+    python cli.py process exports/ --days 30 -o reports/ --jobs 4
+    python cli.py process exports/ --days 30 --combine -o batch.xlsx
+    python cli.py process export.xlsx --days 30 --in-transit transit.xlsx
+    python cli.py snapshot old_exports/ --date 2026-09-01
+    python cli.py process export.xlsx --days 30 --forecast
+    python cli.py snapshot no_warehouse_line.xlsx --warehouse "Основной склад"
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import pipeline
+
+logger = logging.getLogger("ks-orders")
+
+
+def find_exports(inputs: list) -> list:
+    """Expand directories into the .xlsx files they contain (Excel lock files skipped)."""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(".xlsx") and not name.startswith("~$")
+            )
+        else:
+            paths.append(path)
+    return paths
+
+
+def process_one(path: str, output: str, days: int, is_laminate: bool, percentage: float,
+                in_transit=None, live_formulas: bool = False, forecast: bool = False, warehouse: str = None) -> str:
+    report = pipeline.process_export(path, days, is_laminate, percentage, in_transit, live_formulas, forecast, warehouse)
+    with open(output, "wb") as file:
+        file.write(report)
+    return output
+
+
+def percentage_arg(value: str) -> float:
+    percentage = float(value)
+    if not 0 <= percentage <= 1:
+        raise argparse.ArgumentTypeError("must be between 0 and 1")
+    return percentage
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
+def process(args) -> int:
+    paths = find_exports(args.inputs)
+    if not paths:
+        logger.error("No .xlsx files found")
+        return 1
+    is_laminate = args.laminate is not None
+    percentage = args.laminate if is_laminate else 1
+    single = len(paths) == 1 and not os.path.isdir(args.inputs[0])
+    if (args.in_transit or args.forecast) and args.combine:
+        logger.error("--in-transit and --forecast are not supported with --combine")
+        return 1
+    # Read once and sent to the workers as a frame
+    in_transit = pipeline.load_in_transit(args.in_transit) if args.in_transit else None
+
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(paths))) as executor:
+        if args.combine:
+            output = args.output or "processed_batch.xlsx"
+            futures = {executor.submit(pipeline.load, path): path for path in paths}
+            frames, failed = {}, 0
+            for future, path in futures.items():
+                try:
+                    frames[pipeline.export_name(path)] = future.result()
+                except Exception as e:
+                    logger.error(f"{path}: {e}")
+                    failed += 1
+            if frames:
+                with open(output, "wb") as file:
+                    file.write(pipeline.process_batch(frames, args.days, is_laminate, percentage))
+                logger.info(f"Wrote {output} ({len(frames)} files)")
+            return 1 if failed or not frames else 0
+
+        if single:
+            outputs = [args.output or f"{pipeline.export_name(paths[0])}_processed.xlsx"]
+        else:
+            directory = args.output or "."
+            os.makedirs(directory, exist_ok=True)
+            outputs = [os.path.join(directory, f"{pipeline.export_name(path)}_processed.xlsx") for path in paths]
+
+        futures = {
+            executor.submit(process_one, path, output, args.days, is_laminate, percentage, in_transit, args.live_formulas,
+                            args.forecast, args.warehouse): path
+            for path, output in zip(paths, outputs)
+        }
+        failed = 0
+        for future, path in futures.items():
+            try:
+                logger.info(f"Wrote {future.result()}")
+            except Exception as e:
+                logger.error(f"{path}: {e}")
+                failed += 1
+    return 1 if failed else 0
+
+
+def snapshot(args) -> int:
+    paths = find_exports(args.inputs)
+    if not paths:
+        logger.error("No .xlsx files found")
+        return 1
+    failed = 0
+    for path in paths:
+        try:
+            logger.info(f"{path}: {pipeline.record_snapshot(path, args.date, args.history, args.warehouse)}")
+        except Exception as e:
+            logger.error(f"{path}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="ks-orders", description="KS Group order calculation for 1C stock exports.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    process_parser = commands.add_parser("process", help="Build order reports for exports.")
+    process_parser.add_argument("inputs", nargs="+", help=".xlsx exports or directories of them")
+    process_parser.add_argument("--days", type=int, required=True, help="number of days for overstock")
+    process_parser.add_argument("--laminate", type=percentage_arg, metavar="PERCENT",
+                                help="process as a laminate brand with this sales adjustment (0 to 1)")
+    process_parser.add_argument("-o", "--output",
+                                help="output file for one export or --combine, otherwise an output directory")
+    process_parser.add_argument("--combine", action="store_true", help="write one combined workbook for all exports")
+    process_parser.add_argument("--in-transit", metavar="FILE",
+                                help="xlsx with 'Артикул' and 'В Пути' quantities to subtract from the orders")
+    process_parser.add_argument("--live-formulas", action="store_true",
+                                help="with --in-transit, keep formulas linking orders to the 'В Пути' sheet")
+    process_parser.add_argument("--forecast", action="store_true",
+                                help="use daily sales forecast from the snapshot history (HISTORY_DIR) where available")
+    process_parser.add_argument("--warehouse", metavar="NAME",
+                                help="with --forecast, the warehouse whose history to use (default: the export's 'Склад:' line)")
+    process_parser.add_argument("--jobs", type=positive_int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    process_parser.set_defaults(handler=process)
+
+    snapshot_parser = commands.add_parser("snapshot", help="Add exports to the sales history used by --forecast.")
+    snapshot_parser.add_argument("inputs", nargs="+", help=".xlsx exports or directories of them")
+    snapshot_parser.add_argument("--date", type=date.fromisoformat, help="date of the exports, YYYY-MM-DD (default: today)")
+    snapshot_parser.add_argument("--history", metavar="DIR", help="history directory (default: HISTORY_DIR or ./history)")
+    snapshot_parser.add_argument("--warehouse", metavar="NAME",
+                                 help="warehouse of the exports (default: each export's 'Склад:' line)")
+    snapshot_parser.set_defaults(handler=snapshot)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
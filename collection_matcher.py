@@ -0,0 +1,77 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+NO_MATCH = "No Match"
+
+
+def load_features(path: str) -> list:
+    """Load collection codes from a JSON list or a text file with one code per line.
+
+    The order of the codes is their match priority.
+    """
+    with open(path, encoding="utf-8") as file:
+        if path.endswith(".json"):
+            return list(json.load(file))
+        return [line.strip() for line in file if line.strip()]
+
+
+def _can_hide(feature: str, others) -> bool:
+    """Whether a match of `feature` can overlap the start of one of `others`.
+
+    A regex scan resumes after each match, so a code starting inside a matched
+    `feature` (at offset 1 or later) would be skipped.
+    """
+    for offset in range(1, len(feature)):
+        tail = feature[offset:]
+        if any(other.startswith(tail) or tail.startswith(other) for other in others):
+            return True
+    return False
+
+
+class CollectionMatcher:
+    """Classify product names by the first collection code (in list order) they contain.
+
+    All codes are compiled into one alternation ordered by priority, so a single
+    regex scan reports the highest-priority code at every position it visits; the
+    lowest-ranked of those is the answer. Only when a reported code could overlap
+    another one is the name rescanned with a lookahead that tries every position.
+    The result is the same as checking the codes one by one in list order.
+    """
+
+    def __init__(self, features):
+        self.features = list(features)
+        self._rank = {}
+        for rank, feature in enumerate(self.features):
+            self._rank.setdefault(feature, rank)
+        alternation = "|".join(re.escape(feature) for feature in self._rank)
+        self._pattern = re.compile(alternation) if self._rank else None
+        self._overlapping = re.compile(f"(?=({alternation}))") if self._rank else None
+        # Codes whose match may skip over a higher-priority code
+        ranked = list(self._rank)
+        self._hiding = {feature for rank, feature in enumerate(ranked) if _can_hide(feature, ranked[:rank])}
+
+    def match(self, text) -> str:
+        if pd.isna(text):
+            return NO_MATCH
+        return self._match_text(str(text))
+
+    def _match_text(self, text: str) -> str:
+        if self._pattern is None:
+            return NO_MATCH
+        found = self._pattern.findall(text)
+        if not found:
+            return NO_MATCH
+        if not self._hiding.isdisjoint(found):
+            found = self._overlapping.findall(text)
+        return min(found, key=self._rank.__getitem__)
+
+    def classify(self, names: pd.Series) -> pd.Series:
+        """Classify a whole column; each distinct name is scanned only once."""
+        codes, uniques = pd.factorize(names)
+        # Missing names get code -1, which picks the trailing NO_MATCH
+        labels = [self._match_text(name if isinstance(name, str) else str(name)) for name in uniques.tolist()]
+        labels = np.array(labels + [NO_MATCH], dtype=object)
+        return pd.Series(labels[codes], index=names.index, name=names.name)
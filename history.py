@@ -0,0 +1,167 @@
+import os
+import re
+import tempfile
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from orders import article_key
+
+# Where export snapshots are kept, one directory per day (date=YYYY-MM-DD) and source
+HISTORY_DIR = os.environ.get("HISTORY_DIR", "history")
+# Days of snapshots the current level and trend of daily sales are fitted on
+RECENT_DAYS = int(os.environ.get("FORECAST_RECENT_DAYS", 28))
+# Seasonality compares with the same weeks a year earlier (52 weeks keeps weekdays aligned)
+SEASON_DAYS = 364
+# Trend and seasonality may move demand between these multiples of the recent average
+FORECAST_LIMITS = (0.5, 2.0)
+
+ARTICLE = 'Артикул'
+SALES = 'Средние продажи день'
+STOCK = 'Остаток на конец'
+
+
+def _mean(matrix: np.ndarray):
+    """Column means of a (days, articles) matrix ignoring missing days, and the number of days seen."""
+    seen = ~np.isnan(matrix)
+    count = seen.sum(axis=0)
+    total = np.where(seen, matrix, 0.0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count, count
+
+
+def _source_dir(source: str) -> str:
+    """Directory name of a source label: characters other than letters, digits, '.' and '-' become '_'."""
+    return "source=" + (re.sub(r"[^\w.-]+", "_", str(source)).strip(".") or "_")
+
+
+class HistoryStore:
+    """Snapshots of cleaned exports by upload date and source, for demand forecasts.
+
+    A snapshot holds the daily sales and stock per article key (orders.article_key),
+    sorted by article, in `directory`/date=YYYY-MM-DD/source=<source>/<name>. The
+    source is the export's warehouse (ingest.read_export_with_warehouse, or one named
+    explicitly), the same for the bot and cli.py, and a forecast reads only the
+    snapshots of its own source, so exports of different warehouses never mix.
+    Files are Parquet (pyarrow), which stays readable across pandas upgrades and is
+    safe to load from a shared directory. Forecasts read only the days inside their
+    windows, so they take the same time however long the history grows.
+    """
+
+    def __init__(self, directory: str = HISTORY_DIR):
+        self.directory = directory
+
+    def record(self, data: pd.DataFrame, name: str, source: str, day: date = None) -> str:
+        """Store the snapshot of a cleaned export of `source` under `name` (e.g. its content hash); returns its path.
+
+        Recording the same name for the same source and day again is a no-op.
+        """
+        partition = self._partition(day or date.today(), source)
+        path = os.path.join(partition, f"{name}.parquet")
+        if os.path.exists(path):
+            return path
+        snapshot = pd.DataFrame({
+            ARTICLE: [article_key(value) for value in data['Артикул '].tolist()],
+            SALES: data[SALES].to_numpy(dtype='float32'),
+            STOCK: data[STOCK].to_numpy(dtype='float32'),
+        })
+        # Rows of the same article (e.g. several warehouses) are added up
+        snapshot = snapshot.groupby(ARTICLE, sort=True).sum().reset_index()
+        os.makedirs(partition, exist_ok=True)
+        # Written under a temporary name first, so a reader never sees half a file
+        descriptor, temporary = tempfile.mkstemp(suffix=".parquet", dir=partition)
+        os.close(descriptor)
+        try:
+            snapshot.to_parquet(temporary, index=False)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        return path
+
+    def days(self) -> list:
+        """Dates with at least one snapshot of any source, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        days = []
+        for name in os.listdir(self.directory):
+            partition = os.path.join(self.directory, name)
+            if name.startswith("date=") and os.path.isdir(partition) and any(
+                    self._snapshots(os.path.join(partition, source)) for source in os.listdir(partition)):
+                days.append(date.fromisoformat(name[5:]))
+        return sorted(days)
+
+    def sales(self, days, keys: pd.Index, source: str) -> np.ndarray:
+        """Daily sales of `keys` of `source` on each of `days` as a (days, articles) matrix, NaN where unknown.
+
+        Of several snapshots of the source on one day, the last recorded is used.
+        """
+        matrix = np.full((len(days), len(keys)), np.nan)
+        for row, day in enumerate(days):
+            partition = self._partition(day, source)
+            snapshots = self._snapshots(partition)
+            if snapshots:
+                latest = max(snapshots, key=lambda name: os.path.getmtime(os.path.join(partition, name)))
+                matrix[row] = self._read(os.path.join(partition, latest)).reindex(keys).to_numpy(dtype=float)
+        return matrix
+
+    def forecast(self, data: pd.DataFrame, horizon: int, source: str, today: date = None):
+        """Expected daily sales of every row of `data` over the next `horizon` days.
+
+        The recent level and trend come from a least-squares line through the last
+        RECENT_DAYS of snapshots, fitted for all articles at once; the line's average
+        over the horizon is scaled by how sales moved a year earlier from the same
+        weeks into the horizon. Only snapshots of `source` are used. Returns (demand, known): `known` is False for articles
+        without recent history, whose demand is NaN.
+        """
+        today = today or date.today()
+        keys = pd.Index([article_key(value) for value in data['Артикул '].tolist()])
+        # Snapshots are looked up by article, so duplicated articles in `data` share one column
+        unique = keys.unique()
+
+        recent = self.sales([today - timedelta(days=offset) for offset in range(RECENT_DAYS - 1, -1, -1)], unique, source)
+        offsets = np.arange(1 - RECENT_DAYS, 1, dtype=float)[:, None]
+        seen = ~np.isnan(recent)
+        average, count = _mean(recent)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_offset = np.where(seen, offsets, 0.0).sum(axis=0) / count
+            spread = np.where(seen, offsets - mean_offset, 0.0)
+            variance = (spread ** 2).sum(axis=0)
+            slope = np.where(variance > 0, (spread * np.where(seen, recent - average, 0.0)).sum(axis=0) / variance, 0.0)
+        # Level today plus the trend to the middle of the horizon
+        trend = average + slope * (-mean_offset + (horizon + 1) / 2)
+        trend = np.clip(trend, average * FORECAST_LIMITS[0], average * FORECAST_LIMITS[1])
+
+        year_ago = today - timedelta(days=SEASON_DAYS)
+        before, _ = _mean(self.sales([year_ago - timedelta(days=offset) for offset in range(RECENT_DAYS)], unique, source))
+        ahead, _ = _mean(self.sales([year_ago + timedelta(days=offset) for offset in range(1, horizon + 1)], unique, source))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            season = np.where((before > 0) & ~np.isnan(ahead), ahead / before, 1.0)
+        season = np.clip(season, *FORECAST_LIMITS)
+
+        demand = np.maximum(trend * season, 0.0)
+        positions = unique.get_indexer(keys)
+        return demand[positions], count[positions] > 0
+
+    def forecast_export(self, data: pd.DataFrame, horizon: int, source: str, today: date = None):
+        """`data` with 'Средние продажи день' replaced by the forecast where there is history.
+
+        Returns (frame, number of rows forecast); rows without history keep the export's value.
+        """
+        demand, known = self.forecast(data, horizon, source, today)
+        sales = np.where(known, demand, data[SALES].to_numpy(dtype=float))
+        return data.assign(**{SALES: sales}), int(known.sum())
+
+    def _partition(self, day: date, source: str) -> str:
+        return os.path.join(self.directory, f"date={day.isoformat()}", _source_dir(source))
+
+    def _snapshots(self, partition: str) -> list:
+        if not os.path.isdir(partition):
+            return []
+        return sorted(name for name in os.listdir(partition)
+                      if name.endswith(".parquet") and not name.startswith("tmp"))
+
+    def _read(self, path: str) -> pd.Series:
+        snapshot = pd.read_parquet(path, columns=[ARTICLE, SALES])
+        return snapshot.set_index(ARTICLE)[SALES]
@@ -0,0 +1,172 @@
+import operator
+import os
+import re
+import zipfile
+from collections import deque
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.utils.exceptions import InvalidFileException
+
+from orders import add_collections, article_key, export_frame
+from report import ON_THE_WAY_SHEET
+from schema import EXPORT_SCHEMA, IN_TRANSIT_SCHEMA, SchemaError, match_header, to_frame
+
+# Rows of report preamble after the header and of footer at the end of a 1C export
+PREAMBLE_ROWS = 2
+FOOTER_ROWS = 2
+
+# Preamble line naming the warehouse of an export, e.g. 'Склад: Основной склад'
+WAREHOUSE_LINE = re.compile(r'^\s*склад\s*:\s*(.+?)\s*$', re.IGNORECASE)
+
+# Kept rows are converted to a frame every this many rows, so raw cells don't pile up
+CHUNK_ROWS = 8192
+
+# How far down an in-transit sheet the header is looked for
+IN_TRANSIT_HEADER_ROWS = 10
+
+
+def _is_blank(row) -> bool:
+    return all(cell is None or cell == '' for cell in row)
+
+
+def _open_workbook(source):
+    """Open an xlsx file in openpyxl's read-only mode; ValueError if it is not one."""
+    try:
+        return openpyxl.load_workbook(source, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+        raise ValueError(f"Not an xlsx workbook: {e}") from e
+
+
+def _picker(positions: list):
+    """Function returning the cells of a row at `positions` (at least two), short rows padded with None."""
+    pick = operator.itemgetter(*positions)
+    width = max(positions) + 1
+
+    def cells(row):
+        if len(row) < width:
+            # Rows without any cells come as an empty list in read-only mode
+            row = (*row, *(None,) * (width - len(row)))
+        return pick(row)
+    return cells
+
+
+def _warehouse(row):
+    """Warehouse named by a 'Склад: ...' cell of a preamble row, with spacing normalized, or None."""
+    for cell in row:
+        match = WAREHOUSE_LINE.match(cell) if isinstance(cell, str) else None
+        if match:
+            return ' '.join(match.group(1).split())
+    return None
+
+
+def read_export(source) -> pd.DataFrame:
+    """Stream the EXPORT_SCHEMA columns of a 1C export into a cleaned DataFrame (see read_export_with_warehouse)."""
+    return read_export_with_warehouse(source)[0]
+
+
+def read_export_with_warehouse(source):
+    """Stream a 1C export into (cleaned DataFrame, warehouse named in its preamble or None).
+
+    The header row is matched against the EXPORT_SCHEMA first, so a file without the
+    needed columns is rejected (SchemaError) before any of its body is read. The first
+    sheet is then read row by row in openpyxl's read-only mode keeping only the raw
+    cells of those columns; preamble, footer and '-Н' rows are dropped and every column
+    is converted to its schema dtype in one pass (orders.export_frame). The warehouse
+    comes from a 'Склад: ...' line of the preamble.
+    Raises ValueError if the file is not an xlsx workbook or a number is malformed.
+    """
+    warehouse = None
+    workbook = _open_workbook(source)
+    try:
+        worksheet = workbook.worksheets[0]
+        # Read to the real end of the sheet, not the possibly stale <dimension> record (as pd.read_excel does)
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        cells = _picker(match_header(next(rows, ()), EXPORT_SCHEMA))
+
+        # Like pd.read_excel, blank rows count as data except at the very end of the sheet,
+        # so a row is only known not to be footer once FOOTER_ROWS rows follow it and the
+        # last of those is non-blank.
+        frames, kept = [], []
+        pending = deque()
+        index = 0
+        for row in rows:
+            if index < PREAMBLE_ROWS:
+                warehouse = warehouse or _warehouse(row)
+            else:
+                pending.append(row)
+                if not _is_blank(row):
+                    while len(pending) > FOOTER_ROWS:
+                        kept.append(cells(pending.popleft()))
+                        if len(kept) == CHUNK_ROWS:
+                            frames.append(export_frame(list(zip(*kept))))
+                            kept = []
+            index += 1
+        if kept or not frames:
+            frames.append(export_frame(list(zip(*kept)) or [[] for _ in EXPORT_SCHEMA]))
+    finally:
+        workbook.close()
+
+    return (frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)), warehouse
+
+
+def read_in_transit(source) -> pd.DataFrame:
+    """Read an in-transit file into 'Артикул ', 'Номенклатура' and 'В Пути', one row per article.
+
+    Uses the 'В Пути' sheet if there is one (a filled-in report), otherwise the first
+    sheet. The header is the first of the top rows matching IN_TRANSIT_SCHEMA (an
+    article and a quantity column); rows without an article are skipped and
+    quantities of repeated articles are summed. Raises SchemaError if there is no
+    such header and ValueError if a quantity is not a number.
+    """
+    workbook = _open_workbook(source)
+    try:
+        worksheet = workbook[ON_THE_WAY_SHEET] if ON_THE_WAY_SHEET in workbook.sheetnames else workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        for _, header in zip(range(IN_TRANSIT_HEADER_ROWS), rows):
+            try:
+                positions = match_header(header, IN_TRANSIT_SCHEMA)
+                break
+            except SchemaError:
+                continue
+        else:
+            raise SchemaError("In-transit file needs 'Артикул' and 'В Пути' (or 'Количество') columns",
+                              [column.name.strip() for column in IN_TRANSIT_SCHEMA if column.required])
+        present = [position for position in positions if position is not None]
+        cells = _picker(present)
+        columns = iter(list(zip(*(cells(row) for row in rows))) or [()] * len(present))
+    finally:
+        workbook.close()
+
+    raw = [None if position is None else np.asarray(next(columns), dtype=object) for position in positions]
+    articles = pd.Series(raw[0], dtype=object)
+    keep = (articles.notna() & (articles.astype(str).str.strip() != '')).to_numpy()
+    frame = to_frame([None if values is None else values[keep] for values in raw], IN_TRANSIT_SCHEMA)
+    keys = pd.Series([article_key(value) for value in frame['Артикул '].tolist()], dtype=object)
+    return frame.groupby(keys, sort=False).agg({'Артикул ': 'first', 'Номенклатура': 'first', 'В Пути': 'sum'}).reset_index(drop=True)
+
+
+def load_export(source) -> pd.DataFrame:
+    """Read an uploaded export and classify its collections, ready for build_report."""
+    return add_collections(read_export(source))
+
+
+def read_archive(content: bytes) -> list:
+    """Return (file name, bytes) for every .xlsx file in a zip archive.
+
+    Raises zipfile.BadZipFile if `content` is not a zip archive.
+    """
+    exports = []
+    with zipfile.ZipFile(BytesIO(content)) as archive:
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            # Skip folders, macOS resource forks and Excel lock files
+            if member.is_dir() or member.filename.startswith('__MACOSX/') or name.startswith('~$'):
+                continue
+            if name.lower().endswith('.xlsx'):
+                exports.append((name, archive.read(member)))
+    return exports
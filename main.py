@@ -1,35 +1,36 @@
+import asyncio
+import functools
 import os
-from datetime import datetime
+import re
+import zipfile
+from datetime import datetime, timedelta
 import logging
-import pandas as pd
-import json
-from collections import defaultdict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, TypeHandler
 from io import BytesIO
 
-import logging
+from activity_store import PHONE, REPORT, UPLOAD, open_activity_store
+from cache import LRUCache, content_hash
+from history import HistoryStore
+from ingest import read_archive, read_export_with_warehouse, read_in_transit
+from metrics import Trace, peak_rss, registry, start_metrics_server
+from orders import add_collections, build_batch_report, compute_orders, compute_sweep, render_report, render_sweep_report
+from persistence import DatabasePersistence
+from report import write_table
+from schema import SchemaError
+from sessions import SessionStore, SharedSessionStore, compact_frame, frame_size
+from workers import JobQueue
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 
-# Dictionary to track user activity
-user_activity = defaultdict(lambda: {
-    "usage_count": 0, 
-    "phone_number": None,
-    "last_used": None
-})
+# User activity store (PostgreSQL if DATABASE_URL is set, else SQLite); writes are buffered
+activity = open_activity_store()
 
+# Old activity file, imported into the store once on startup
 USER_ACTIVITY_FILE = "user_activity.json"
-
-# Load previous activity from file
-if os.path.exists(USER_ACTIVITY_FILE):
-    with open(USER_ACTIVITY_FILE, "r") as file:
-        user_activity.update(json.load(file))
+# How often buffered activity is written to the store
+ACTIVITY_FLUSH_SECONDS = float(os.environ.get("ACTIVITY_FLUSH_SECONDS", 5))
 
 # Admin Telegram ID (set as Heroku environment variable)
 ADMIN_TELEGRAM_ID = os.environ.get("ADMIN_TELEGRAM_ID")
@@ -37,9 +38,63 @@ ADMIN_TELEGRAM_ID = os.environ.get("ADMIN_TELEGRAM_ID")
 # Retrieve the bot token from environment variables
 BOT_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 
+# Webhook mode: set WEBHOOK_URL to the public base URL (e.g. https://<app>.herokuapp.com);
+# without it the bot uses long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # Checked against Telegram's secret token header
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8443))  # Set by Heroku for web dynos
+# Updates processed at the same time; 1 keeps each user's messages strictly in order
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 1))
+# Bot API server, e.g. a local fake Telegram server for testing (default: api.telegram.org)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+# How often user data and conversation states are written to the database (seconds)
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", 5))
+# Set to 1 when several bot processes serve the bot (webhook mode behind a load balancer): each update
+# then reads the user's state from the database and writes it back, and uploads wait in SESSION_DIR,
+# which the processes must share
+SHARED_STATE = os.environ.get("SHARED_STATE") == "1"
+
 ALLOWED_NUMBERS = ["+998916919534", "+998958330373", "+998933881404","+998884758000","+998998449669"]  # Replace with your company's authorized phone numbers
 
-ASK_FILE, ASK_DAYS, ASK_BRAND, ASK_PERCENTAGE = range(4)  # Define the states
+ASK_FILE, ASK_DAYS, ASK_BRAND, ASK_PERCENTAGE, ASK_BATCH = range(5)  # Define the states
+
+# Most periods in one scenario sweep ("30 60 90" at the days question)
+MAX_SWEEP_DAYS = 6
+DAYS_PROMPT = "Теперь, пожалуйста, введите количество дней для overstock (или несколько через пробел для сравнения сценариев):"
+RERUN_BUTTON = InlineKeyboardButton("🔁 Пересчитать с другими параметрами", callback_data="rerun")
+RERUN_MARKUP = InlineKeyboardMarkup([[RERUN_BUTTON]])
+# Single-export reports can be redone with daily sales forecast from past uploads
+REPORT_MARKUP = InlineKeyboardMarkup([
+    [RERUN_BUTTON],
+    [InlineKeyboardButton("📈 Пересчитать по истории продаж", callback_data="forecast")],
+])
+IN_TRANSIT_HINT = "Чтобы вычесть товары в пути, сначала отправьте файл «В Пути» (.xlsx с колонками Артикул и В Пути)."
+IN_TRANSIT_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("Заказ значениями", callback_data="transit_values"),
+    InlineKeyboardButton("Оставить формулы", callback_data="transit_formulas"),
+]])
+
+# Pool for the CPU-bound steps so the event loop keeps answering other users
+jobs = JobQueue()
+
+# Caches for re-uploaded exports: Telegram file_unique_id -> content hash,
+# content hash -> (cleaned DataFrame, warehouse), (hash, days, is_laminate, percentage) -> report bytes
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 6 * 60 * 60))  # seconds
+upload_hashes = LRUCache(max_size=1000, ttl=CACHE_TTL)
+parsed_exports = LRUCache(max_size=int(os.environ.get("PARSED_CACHE_MB", 64)) * 2**20, ttl=CACHE_TTL,
+                          sizeof=lambda parsed: frame_size(parsed[0]))
+reports = LRUCache(max_size=int(os.environ.get("REPORT_CACHE_MB", 64)) * 2**20, ttl=CACHE_TTL, sizeof=len)
+
+# Uploads waiting for the user's parameters, by Telegram user id; kept out of user_data
+# so abandoned conversations expire and big files are spilled to disk under memory pressure
+sessions = SharedSessionStore() if SHARED_STATE else SessionStore()
+# How often idle sessions are looked for (seconds)
+SESSION_SWEEP_SECONDS = float(os.environ.get("SESSION_SWEEP_SECONDS", 60))
+
+# Snapshot of every upload by date, for the trend/seasonality forecast of daily sales
+history = HistoryStore()
 
 
 
@@ -51,20 +106,28 @@ def normalize_phone_number(phone_number: str) -> str:
         phone_number = "+" + phone_number
     return phone_number
 
+def transit_key(user_id: int) -> str:
+    """Session store key of a user's in-transit frame."""
+    return f"{user_id}_transit"
+
+def batch_key(user_id: int, file_hash: str = "") -> str:
+    """Session store key of a batch file kept for all bot processes (SHARED_STATE); without a hash, the prefix of all of them."""
+    return f"{user_id}_batch_{file_hash}"
+
+def queue_notifier(message):
+    """Build a callback that tells the user their place in the processing queue."""
+    async def notify(position: int) -> None:
+        await message.reply_text(f"⏳ Ваш файл в очереди на обработку. Позиция в очереди: {position}")
+    return notify
+
 async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle phone numbers sent via the 'Share Phone Number' button."""
     user = update.message.from_user
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+
     if update.message.contact:  # Phone number shared via "Share Phone Number" button
         phone_number = normalize_phone_number(update.message.contact.phone_number)
-        user_activity[user.username]["phone_number"] = phone_number  # Store phone number
-        user_activity[user.username]["usage_count"] += 1  # Increment usage count
-        user_activity[user.username]["last_used"] = now
-        # Save updated activity to file
-        with open(USER_ACTIVITY_FILE, "w") as file:
-            json.dump(user_activity, file)
-            
+        activity.record(user.username or str(user.id), phone_number=phone_number, event=PHONE)  # Store phone number and count the use
+
         # Check if the phone number is in the allowed list
         if phone_number in ALLOWED_NUMBERS:
             context.user_data['verified'] = True  # Mark the user as verified
@@ -90,14 +153,8 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the bot and request phone verification if needed."""
     user = update.message.from_user
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user_activity[user.username]["usage_count"] += 1
-    user_activity[user.username]["last_used"] = now
+    activity.record(user.username or str(user.id))
 
-    # Save updated activity to file
-    with open(USER_ACTIVITY_FILE, "w") as file:
-        json.dump(user_activity, file)
-    
     # Check if the user has already verified their phone number
     if 'verified' in context.user_data and context.user_data['verified']:
         await update.message.reply_text("Пожалуйста, отправьте мне Excel файл, который вы хотите обработать.")
@@ -117,16 +174,66 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Перезапуск процесса. Пожалуйста, отправьте мне Excel файл, который вы хотите обработать.")
     context.user_data.clear()  # Clear previous data to start fresh
+    await asyncio.to_thread(sessions.discard, update.effective_user.id)
+    await asyncio.to_thread(sessions.discard, transit_key(update.effective_user.id))
+    await discard_batch_files(update.effective_user.id)
     return ASK_FILE  # Directly transition to ASK_FILE state
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info(f"Cancel command received from user: {update.message.chat.username}")
     await update.message.reply_text("Процесс отменен. Вы можете начать заново, набрав /start.")
     context.user_data.clear()  # Clear any data in case they want to start again
+    await asyncio.to_thread(sessions.discard, update.effective_user.id)
+    await asyncio.to_thread(sessions.discard, transit_key(update.effective_user.id))
+    await discard_batch_files(update.effective_user.id)
     return ConversationHandler.END
 
 
 
+async def parse_export(content: bytes, trace: Trace, notify=None):
+    """Return (content hash, cleaned DataFrame, warehouse or None) for an uploaded export, using the parse cache."""
+    file_hash = content_hash(content)
+    parsed = parsed_exports.get(file_hash)
+    if parsed is None:
+        # Stream the needed columns into a cleaned DataFrame (in the worker pool) and cache it
+        with trace.span("parse") as span:
+            data, warehouse = await jobs.run(read_export_with_warehouse, BytesIO(content), notify=notify, span=span)
+            span.bytes_in, span.rows = len(content), len(data)
+        with trace.span("classify") as span:
+            data = await jobs.run(add_collections, data, span=span)
+            span.rows = len(data)
+        parsed = await asyncio.to_thread(compact_frame, data), warehouse
+        parsed_exports.put(file_hash, parsed)
+    return (file_hash, *parsed)
+
+
+async def record_snapshot(data, file_hash: str, warehouse: str, trace: Trace) -> None:
+    """Add an upload to the sales history of its warehouse; a failure is logged and does not stop the upload.
+
+    Exports that name no warehouse are not recorded, so they never mix into another warehouse's history.
+    """
+    if warehouse is None:
+        logger.info(f"Export {file_hash[:12]} names no warehouse; not added to the sales history")
+        return
+    try:
+        with trace.span("snapshot") as span:
+            await asyncio.to_thread(history.record, data, file_hash, warehouse)
+            span.rows = len(data)
+    except Exception:
+        logger.exception(f"Failed to store the snapshot of export {file_hash[:12]}")
+
+
+async def parse_batch_file(content: bytes, username: str):
+    """parse_export for one batch file, traced on its own since batch files are parsed concurrently."""
+    trace = Trace("batch_file", username)
+    try:
+        file_hash, data, warehouse = await parse_export(content, trace)
+        await record_snapshot(data, file_hash, warehouse, trace)
+        return file_hash, data
+    finally:
+        trace.finish()
+
+
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Download file and convert it to pandas DataFrame
     user = update.message.from_user
@@ -136,35 +243,252 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     logger.info(f"User {user.username} (ID: {user.id}) uploaded file: {file_name} (Size: {file_size} bytes)")
 
-    file = await update.message.document.get_file()
-    excel_bytes = BytesIO()
-    await file.download_to_memory(excel_bytes)
-    excel_bytes.seek(0)
+    # A known file_unique_id lets us skip the download of a re-uploaded export
+    file_hash = upload_hashes.get(document.file_unique_id)
+    parsed = parsed_exports.get(file_hash) if file_hash else None
+    trace = Trace("upload", user.username or str(user.id))
     try:
-        # Load the data into a DataFrame and store it
-        data = pd.read_excel(excel_bytes)
-        context.user_data['data'] = data  # Store the DataFrame for further processing
+        if parsed is None:
+            with trace.span("download") as span:
+                file = await update.message.document.get_file()
+                excel_bytes = BytesIO()
+                await file.download_to_memory(excel_bytes)
+                span.bytes_in = len(excel_bytes.getbuffer())
+            file_hash = content_hash(excel_bytes.getvalue())
+            upload_hashes.put(document.file_unique_id, file_hash)
+            parsed = parsed_exports.get(file_hash)
+
+        if parsed is None:
+            file_hash, data, warehouse = await parse_export(excel_bytes.getvalue(), trace, notify=queue_notifier(update.message))
+        else:
+            data, warehouse = parsed
+            logger.info(f"Using cached export {file_hash[:12]} for {user.username} (ID: {user.id}). Cache: {parsed_exports.stats()}")
+        await record_snapshot(data, file_hash, warehouse, trace)
+        await asyncio.to_thread(sessions.put, user.id, data)  # Keep the DataFrame for further processing
+        await asyncio.to_thread(sessions.discard, transit_key(user.id))  # A new export starts without goods in transit
+        context.user_data.pop('transit_hash', None)
+        context.user_data['file_hash'] = file_hash
+        context.user_data['warehouse'] = warehouse
+        activity.record_event(user.username or str(user.id), UPLOAD)
         logger.info(f"File from {user.username} (ID: {user.id}) is being processed.")
-        await update.message.reply_text("Теперь, пожалуйста, введите количество дней для overstock:")
+        await update.message.reply_text(f"{DAYS_PROMPT}\n{IN_TRANSIT_HINT}")
         return ASK_DAYS
+    except SchemaError as e:
+        logger.error(f"Rejected file from {user.username} (ID: {user.id}): {e}")
+        await update.message.reply_text(
+            f"Ошибка: В файле нет колонок: {', '.join(e.missing)}. Пожалуйста, загрузите выгрузку остатков из 1С."
+        )
+        return ASK_FILE
     except ValueError as e:
         logger.error(f"Error processing file from {user.username} (ID: {user.id}): {e}")
         await update.message.reply_text("Ошибка: Не удалось прочитать файл как допустимый файл Excel. Пожалуйста, загрузите допустимый файл .xlsx.")
-        print("File read error:", e)
         return ASK_FILE  # Stay in the same state if file reading fails
 
-    except Exception as e:
+    except Exception:
+        logger.exception(f"Error saving file from {user.username} (ID: {user.id})")
         await update.message.reply_text("Произошла ошибка при сохранении файла.")
-        print("File save error:", e)
         return ASK_FILE
+    finally:
+        trace.finish()
+
+
+def is_batch(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Whether the pending upload is a batch, whose file_hash is a tuple of (name, hash) pairs.
+
+    Answers from user_data, so the session frame is not loaded on the event loop just to test its type.
+    """
+    return isinstance(context.user_data.get('file_hash'), tuple)
+
+
+async def handle_in_transit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Read an in-transit file sent at the days question; its quantities are subtracted from the order."""
+    user = update.message.from_user
+    if is_batch(context):
+        await update.message.reply_text("Файл «В Пути» можно учесть только для одного файла. Введите количество дней:")
+        return ASK_DAYS
+
+    trace = Trace("in_transit", user.username or str(user.id))
+    try:
+        with trace.span("download") as span:
+            file = await update.message.document.get_file()
+            content = BytesIO()
+            await file.download_to_memory(content)
+            span.bytes_in = len(content.getbuffer())
+        with trace.span("parse_in_transit") as span:
+            in_transit = await jobs.run(read_in_transit, BytesIO(content.getvalue()), span=span)
+            span.rows = len(in_transit)
+    except ValueError as e:
+        logger.error(f"Error reading in-transit file from {user.username} (ID: {user.id}): {e}")
+        await update.message.reply_text(
+            "Ошибка: В файле «В Пути» нужны колонки Артикул и В Пути (или Количество). Введите количество дней или отправьте другой файл:"
+        )
+        return ASK_DAYS
+    finally:
+        trace.finish()
+
+    await asyncio.to_thread(sessions.put, transit_key(user.id), in_transit)
+    context.user_data['transit_hash'] = content_hash(content.getvalue())
+    context.user_data['live_formulas'] = False
+    await update.message.reply_text(
+        f"Файл «В Пути» принят: {len(in_transit)} артикулов. Заказ будет записан значениями; "
+        "при желании можно оставить формулы, связанные с листом «В Пути».\n"
+        "Теперь введите количество дней для overstock:",
+        reply_markup=IN_TRANSIT_MARKUP,
+    )
+    return ASK_DAYS
+
+
+async def choose_transit_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Write the order as values or keep formulas for the rows with goods in transit."""
+    query = update.callback_query
+    await query.answer()
+    context.user_data['live_formulas'] = query.data == "transit_formulas"
+    await query.edit_message_text(
+        "Заказ будет связан формулами с листом «В Пути». Введите количество дней для overstock:"
+        if context.user_data['live_formulas'] else
+        "Заказ будет записан значениями. Введите количество дней для overstock:"
+    )
+    return ASK_DAYS
+
+
+async def start_batch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start collecting several exports to process with the same parameters."""
+    await asyncio.to_thread(sessions.discard, update.effective_user.id)
+    await discard_batch_files(update.effective_user.id)
+    context.user_data['batch'] = {}
+    await update.message.reply_text(
+        "Пакетная обработка. Отправьте несколько файлов .xlsx или архив .zip с ними, затем введите /done."
+    )
+    return ASK_BATCH
+
+
+async def handle_batch_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Download a batch file (or every .xlsx in a zip) and start parsing it in the background."""
+    user = update.message.from_user
+    document = update.message.document
+    logger.info(f"User {user.username} (ID: {user.id}) added batch file: {document.file_name} (Size: {document.file_size} bytes)")
+
+    trace = Trace("batch_download", user.username or str(user.id))
+    with trace.span("download") as span:
+        file = await document.get_file()
+        content = BytesIO()
+        await file.download_to_memory(content)
+        span.bytes_in = len(content.getbuffer())
+    trace.finish()
+
+    if document.file_name.lower().endswith(".zip"):
+        try:
+            exports = await asyncio.to_thread(read_archive, content.getvalue())
+        except zipfile.BadZipFile:
+            await update.message.reply_text("Ошибка: Не удалось открыть архив .zip.")
+            return ASK_BATCH
+    else:
+        exports = [(document.file_name, content.getvalue())]
+
+    batch = context.user_data.setdefault('batch', {})
+    for file_name, excel_bytes in exports:
+        # Files are parsed in parallel while the user sends the rest
+        task = asyncio.get_running_loop().create_task(parse_batch_file(excel_bytes, user.username or str(user.id)))
+        if SHARED_STATE:
+            # /done may reach another process: the file goes to the shared sessions, the task is used if /done comes here
+            file_hash = content_hash(excel_bytes)
+            await asyncio.to_thread(sessions.put, batch_key(user.id, file_hash), (file_name, excel_bytes))
+            batch[file_hash] = task
+        else:
+            batch[batch_name(batch, file_name)] = task
+
+    received = len(await asyncio.to_thread(sessions.keys, batch_key(user.id))) if SHARED_STATE else len(batch)
+    await update.message.reply_text(f"Файлов получено: {received}. Отправьте ещё или введите /done.")
+    return ASK_BATCH
+
+
+def batch_name(batch: dict, file_name: str) -> str:
+    """The file name without extension, numbered if the batch already has it."""
+    name, number = os.path.splitext(file_name)[0], 1
+    while name in batch:
+        number += 1
+        name = f"{os.path.splitext(file_name)[0]} ({number})"
+    return name
+
+
+async def shared_batch(user_id: int, parsing: dict, username: str) -> dict:
+    """{name: parse task} of the batch files any bot process received (SHARED_STATE).
+
+    Tasks started here are taken from `parsing` ({content hash: task}); files received
+    by other processes are parsed now. The files are removed from the shared sessions.
+    """
+    files = []
+    for key in await asyncio.to_thread(sessions.keys, batch_key(user_id)):
+        stored = await asyncio.to_thread(sessions.get, key)
+        await asyncio.to_thread(sessions.discard, key)
+        if stored is not None:
+            files.append((key[len(batch_key(user_id)):], *stored))
+
+    batch = {}
+    for file_hash, file_name, excel_bytes in sorted(files, key=lambda file: file[1]):
+        task = parsing.pop(file_hash, None) or asyncio.get_running_loop().create_task(parse_batch_file(excel_bytes, username))
+        batch[batch_name(batch, file_name)] = task
+    return batch
+
+
+async def discard_batch_files(user_id: int) -> None:
+    """Drop the batch files kept in the shared sessions for the user (SHARED_STATE)."""
+    for key in await asyncio.to_thread(sessions.keys, batch_key(user_id)):
+        await asyncio.to_thread(sessions.discard, key)
+
+
+async def finish_batch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Wait for all batch files to be parsed and ask for the parameters."""
+    batch = context.user_data.pop('batch', {})
+    if SHARED_STATE:
+        user = update.effective_user
+        batch = await shared_batch(user.id, batch, user.username or str(user.id))
+    if not batch:
+        context.user_data['batch'] = {}
+        await update.message.reply_text("Сначала отправьте хотя бы один файл .xlsx или .zip.")
+        return ASK_BATCH
+
+    results = await asyncio.gather(*batch.values(), return_exceptions=True)
+    frames, keys, failed = {}, [], []
+    for name, result in zip(batch, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing batch file {name}: {result}")
+            failed.append(name)
+        else:
+            file_hash, frames[name] = result
+            keys.append((name, file_hash))
+
+    if failed:
+        await update.message.reply_text("Не удалось прочитать файлы: " + ", ".join(failed))
+    if not frames:
+        context.user_data['batch'] = {}
+        await update.message.reply_text("Пожалуйста, отправьте допустимые файлы .xlsx.")
+        return ASK_BATCH
+
+    await asyncio.to_thread(sessions.put, update.effective_user.id, frames)
+    context.user_data['file_hash'] = tuple(keys)
+    activity.record_event(update.effective_user.username or str(update.effective_user.id), UPLOAD)
+    await update.message.reply_text(f"Файлов к обработке: {len(frames)}. Теперь, пожалуйста, введите количество дней для overstock:")
+    return ASK_DAYS
 
 
 async def handle_days(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.effective_user.id not in sessions:
+        await update.message.reply_text("Время ожидания истекло. Пожалуйста, отправьте Excel файл заново.")
+        return ASK_FILE
     try:
-        # Strip leading/trailing spaces from input and handle commas or unexpected characters
-        days_input = update.message.text.strip() # Remove commas if present
-        days = int(days_input)  # Convert the cleaned input to an integer
-        context.user_data['days'] = days
+        # One number, or several separated by spaces or commas for a scenario sweep
+        days_list = sorted({int(value) for value in re.split(r"[\s,;]+", update.message.text.strip()) if value})
+        if not days_list:
+            raise ValueError("no days")
+        if len(days_list) > 1:
+            if len(days_list) > MAX_SWEEP_DAYS:
+                await update.message.reply_text(f"Можно сравнить не более {MAX_SWEEP_DAYS} сценариев.")
+                return ASK_DAYS
+            if is_batch(context):
+                await update.message.reply_text("Сравнение сценариев доступно только для одного файла. Введите одно число.")
+                return ASK_DAYS
+        context.user_data['days'] = days_list[0] if len(days_list) == 1 else tuple(days_list)
 
         keyboard = [
             [InlineKeyboardButton("Да", callback_data="yes"), InlineKeyboardButton("Нет", callback_data="no")]
@@ -191,6 +515,7 @@ async def handle_brand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         return ASK_PERCENTAGE  # Ask for the percentage if it's Laminate
     else:
         context.user_data['is_laminate'] = False
+        context.user_data.pop('percentage', None)  # Left over from an earlier laminate run
         await query.edit_message_text("Обработка без подбора характеристик.")
         # Continue processing the file without laminate adjustments
         await process_file(update, context)
@@ -217,8 +542,118 @@ async def handle_percentage(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ASK_PERCENTAGE
 
 
+async def rerun(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Ask for new parameters for the last uploaded file, reusing its cleaned, classified frame."""
+    query = update.callback_query
+    await query.answer()
+    if update.effective_user.id not in sessions:
+        await query.message.reply_text("Время ожидания истекло. Пожалуйста, отправьте Excel файл заново.")
+        return ASK_FILE
+    await query.message.reply_text(DAYS_PROMPT)
+    return ASK_DAYS
+
+
+async def rerun_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Redo the last report with daily sales forecast from the upload history."""
+    query = update.callback_query
+    await query.answer()
+    if update.effective_user.id not in sessions or 'days' not in context.user_data:
+        await query.message.reply_text("Время ожидания истекло. Пожалуйста, отправьте Excel файл заново.")
+        return ASK_FILE
+    await process_file(update, context, forecast=True)
+    return ConversationHandler.END
+
+
+# Running non-blocking handler of each user, so /cancel and /start can stop it
+running_jobs = {}
+# State a stopped handler ends the conversation in, set by interrupt
+interrupted_states = {}
+
+
+def interruptible(callback):
+    """Wrap a non-blocking handler so that interrupt can stop it while it runs.
+
+    ConversationHandler ignores the states returned in WAITING, so a stopped handler
+    returns the state of the command that stopped it instead of its own.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        task = running_jobs[user_id] = asyncio.current_task()
+        if SHARED_STATE:
+            # The conversation state this handler returns is known once its task is done
+            task.add_done_callback(lambda _: context.application.create_task(context.application.update_persistence()))
+        try:
+            return await callback(update, context)
+        except asyncio.CancelledError:
+            if running_jobs.get(user_id) is task:
+                raise  # Not stopped by interrupt, e.g. the bot is shutting down
+            # Whatever the handler kept before it stopped is dropped
+            await asyncio.to_thread(sessions.discard, user_id)
+            await asyncio.to_thread(sessions.discard, transit_key(user_id))
+            return interrupted_states.pop(user_id, ConversationHandler.END)
+        finally:
+            if running_jobs.get(user_id) is task:
+                del running_jobs[user_id]
+    return wrapper
+
+
+async def interrupt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/cancel or /start while a file is being processed: stop the processing and run the command."""
+    user_id = update.effective_user.id
+    task = running_jobs.pop(user_id, None)
+    command = cancel if update.message.text.split()[0].split("@")[0] == "/cancel" else start
+    interrupted_states[user_id] = await command(update, context)
+    if task is not None:
+        task.cancel()
+    else:
+        interrupted_states.pop(user_id, None)
+
+
+async def handle_busy(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer updates that arrive while the user's file is still being processed."""
+    if update.callback_query:
+        await update.callback_query.answer()
+    message = update.effective_message
+    if message is not None:
+        await message.reply_text("Ваш файл ещё обрабатывается, пожалуйста, подождите. /cancel — отменить.")
+
+
+async def load_shared_state(conversation: ConversationHandler, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """First handler of every update (SHARED_STATE): take the conversation state another bot process left in the database.
+
+    User data is refreshed by the persistence itself before this runs.
+    """
+    if update.effective_user is None or update.effective_chat is None:
+        return
+    # The conversation key of a ConversationHandler with per_chat and per_user
+    key = (update.effective_chat.id, update.effective_user.id)
+    await context.application.persistence.refresh_conversation(conversation, key)
+
+
+async def save_shared_state(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Last handler of every update (SHARED_STATE): write the state now, as the next update may go to another process."""
+    if update.effective_user is not None:
+        context.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+    await context.application.update_persistence()
+
+
+# /stats report kinds: sheet name and columns
+STATS_REPORTS = {
+    "users": ("User Activity", ["Username", "Usage Count", "Phone Number", "Last Used"]),
+    "daily": ("Daily Activity", ["Day", "Event", "Count"]),
+    "byuser": ("Activity By User", ["Username", "Event", "Count"]),
+    "events": ("Events", ["Time", "Username", "Event"]),
+}
+
+
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send user activity logs as an Excel file to the admin, optionally filtered by date range."""
+    """Send user activity to the admin as an Excel file.
+
+    Usage: /stats [users|daily|byuser|events] [YYYY-MM-DD [YYYY-MM-DD]] [@username]
+    `users` lists users by last use, `daily` gives event counts per day, `byuser`
+    event counts per user over the range, and `events` the raw event log.
+    """
     user_id = str(update.message.chat.id)
     admin_id = str(ADMIN_TELEGRAM_ID)
 
@@ -227,8 +662,11 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("You are not authorized to use this command.")
         return
 
-    # Parse optional date arguments
-    args = context.args
+    # Parse optional report kind, user and date arguments
+    args = list(context.args)
+    kind = args.pop(0) if args and args[0] in STATS_REPORTS else "users"
+    username = next((arg[1:] for arg in args if arg.startswith("@")), None)
+    args = [arg for arg in args if not arg.startswith("@")]
     start_date = None
     end_date = None
 
@@ -238,7 +676,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             end_date = datetime.strptime(args[1], "%Y-%m-%d")
         elif len(args) == 1:
             start_date = datetime.strptime(args[0], "%Y-%m-%d")
-            end_date = start_date  # Single date means exact match
+            end_date = start_date  # Single date means that whole day
         else:
             # No date provided; include all data
             start_date = None
@@ -246,224 +684,288 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         logger.error("Invalid date format provided in /stats command.")
         await update.message.reply_text(
-            "Invalid date format. Please use `/stats YYYY-MM-DD [YYYY-MM-DD]`."
+            "Invalid date format. Please use `/stats [users|daily|byuser|events] [YYYY-MM-DD [YYYY-MM-DD]] [@username]`."
         )
         return
 
-    logger.info(f"Generating stats. Start Date: {start_date}, End Date: {end_date}")
-
-    # Filter user activity based on date range
-    filtered_data = []
-    for username, details in user_activity.items():
-        last_used = details.get("last_used")
-        logger.debug(f"Checking user: {username}, Last Used: {last_used}")
-        if last_used:
-            try:
-                last_used_date = datetime.strptime(last_used, "%Y-%m-%d %H:%M:%S")
-                if start_date and end_date:
-                    # Filter by date range
-                    if start_date <= last_used_date <= end_date:
-                        filtered_data.append({
-                            "Username": username,
-                            "Usage Count": details["usage_count"],
-                            "Phone Number": details["phone_number"],
-                            "Last Used": details["last_used"]
-                        })
-                else:
-                    # Include all data when no date range is specified
-                    filtered_data.append({
-                        "Username": username,
-                        "Usage Count": details["usage_count"],
-                        "Phone Number": details["phone_number"],
-                        "Last Used": details["last_used"]
-                    })
-            except ValueError:
-                logger.error(f"Invalid date format in last_used for user {username}: {last_used}")
-                continue
-
-    if not filtered_data:
-        await update.message.reply_text("No activity found.")
-        return
+    logger.info(f"Generating {kind} stats. Start Date: {start_date}, End Date: {end_date}, User: {username}")
+
+    # The end date is inclusive, the store queries take [start, end)
+    end_exclusive = end_date + timedelta(days=1) if end_date else None
+    if kind == "users":
+        rows = lambda: activity.iter_users(start_date, end_exclusive, username)
+    elif kind == "events":
+        rows = lambda: activity.iter_events(start_date, end_exclusive, username)
+    elif kind == "daily":
+        rows = lambda: activity.iter_daily(start_date and start_date.date(), end_exclusive and end_exclusive.date(), username)
+    else:
+        rows = lambda: activity.iter_user_totals(start_date and start_date.date(), end_exclusive and end_exclusive.date(), username)
+
+    # Query rows are streamed straight into the workbook
+    def build_stats():
+        activity.flush()
+        output = BytesIO()
+        sheet_name, columns = STATS_REPORTS[kind]
+        return output, write_table(output, sheet_name, columns, rows())
 
-    logger.info(f"Filtered Data: {filtered_data}")
+    output, count = await asyncio.to_thread(build_stats)
 
-    # Convert filtered data to a DataFrame
-    df = pd.DataFrame(filtered_data)
+    if not count:
+        await update.message.reply_text("No activity found.")
+        return
 
-    # Generate an Excel file
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="User Activity")
+    logger.info(f"Stats report with {count} rows")
     output.seek(0)
 
     # Send the Excel file
     await update.message.reply_document(
         document=output,
-        filename="user_activity.xlsx" if not start_date else "user_activity_filtered.xlsx",
-        caption=f"📊 User activity log{' from all time' if not start_date else f' from {start_date.date()} to {end_date.date()}'}."
+        filename=f"user_activity_{kind}.xlsx" if not start_date else f"user_activity_{kind}_filtered.xlsx",
+        caption=f"📊 User activity log{' from all time' if not start_date else f' from {start_date.date()} to {end_date.date()}'}"
+                f"{f' for @{username}' if username else ''}."
     )
 
 
-
-
-async def process_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def process_file(update: Update, context: ContextTypes.DEFAULT_TYPE, forecast: bool = False) -> None:
     # Identify if we have an update from a callback query or a regular message
     message = update.message if update.message else update.callback_query.message
-    
+    user = update.effective_user
+    trace = Trace("report", user.username or str(user.id))
+
     try:
-       # Access the stored file and DataFrame from user_data
-        data = context.user_data.get('data')  # This is the pandas DataFrame already stored
+        # The uploaded DataFrame, or {file name: DataFrame} in batch mode
+        pending = await asyncio.to_thread(sessions.get, user.id)
+        batch = pending if isinstance(pending, dict) else None
+        data = None if batch else pending
         days = context.user_data.get('days')
         is_laminate = context.user_data.get('is_laminate', False)
         percentage = context.user_data.get('percentage', 1)
+        # Goods in transit, if the user sent a file for them (single exports only)
+        in_transit = None
+        if not batch and context.user_data.get('transit_hash'):
+            in_transit = await asyncio.to_thread(sessions.get, transit_key(user.id))
+        live_formulas = in_transit is not None and context.user_data.get('live_formulas', False)
         
-        if data is None:
+        if data is None and not batch:
             await message.reply_text("Ошибка: Данные не были загружены.")
             return ConversationHandler.END  # Exit if data is not available
-    
-        
-        
-            # Adjust daily sales based on the percentage
-            
-        # Data processing logic
-        data0 = data[2:]
-        data0 = data0[:-2]
-
-        cols = ['Артикул ', 'Номенклатура', 'Дней на распродажи',
-                'Остаток на конец', 'Средние продажи день',
-                'Прошло дней от последней продажи']
-
-        data1 = data0[cols]
-        data1 = data1.reset_index(drop=True)
-
-        # Dropping '-H' values
-        data1 = data1.drop(data1[data1['Артикул '].astype(str).str.contains("-Н", na=False)].index)
-        
-        # Dealing with numbers of selling days
-        data1['Дней на распродажи'] = data1['Дней на распродажи'].str.replace(' ', '')
-        data1['Прошло дней от последней продажи'] = data1['Прошло дней от последней продажи'].str.replace(' ', '')
-        data1 = data1.replace({'∞': -1})
-        data1 = data1.fillna(0)
-        data1[['Дней на распродажи', 'Прошло дней от последней продажи']] = data1[['Дней на распродажи', 'Прошло дней от последней продажи']].astype(int)
-        data1 = data1.reset_index(drop=True)
-
-        data1['Общый продажи период'] = data1['Средние продажи день'] * days
-        data1['helper'] = 0.0  # Set as float to allow numerical and 'overstock' entries
-        data1['overstock'] = 0.0
-        data1['outofstock'] = 0
-        data1['В Пути'] = 0
-        
-        # Ensure numerical columns are float-compatible
-        if is_laminate:
-            # Adjust the average daily sales if it's Laminate
-            data1['Общый продажи период'] = data1['Средние продажи день'] * days * percentage
-            #making a class column 
-        
-        
-
-        for i, value in enumerate(data1['Дней на распродажи']):
-            if value <= days and value >= 0:
-                # Calculate purchase as float
-                data1.loc[i, 'helper'] = float(data1.loc[i, 'Общый продажи период'] - data1.loc[i, 'Остаток на конец'])
-            else:
-                # Set 'overstock' string, handled by float-compatible column
-                data1.loc[i, 'helper'] = 0
-                data1.loc[i, 'overstock'] = float(data1.loc[i, 'Остаток на конец'] - data1.loc[i, 'Общый продажи период'])
-
-        for i, value in enumerate(data1['Остаток на конец']):
-            if value <= 50:
-                data1.loc[i, 'outofstock'] = data1.loc[i, 'Прошло дней от последней продажи'] * data1.loc[i, 'Средние продажи день']*percentage - data1.loc[i, 'Остаток на конец']
-
-        data1['Рекомендательный Заказ'] = 'helper - on_the_way'
-
-        features = ['ЕMR','EMR','YEL','WHT','ULT','SF','RUB','RED','PG','ORN','NC',
-                    'LM','LAG','IND','GRN','GREY','FP STNX','FP PLC','FP NTR','CHR',
-                    'BLU','BLA','AMB']
-
-        def find_feature(text):
-            for feature in features:
-                if pd.notna(text) and feature in text:
-                    return feature
-            return "No Match"
-
-        # Apply the function to the column containing text (e.g., 'Description')
-        data1['Коллекция'] = data1['Номенклатура'].apply(find_feature)
-        # Creating the `purchase_df` with the necessary columns
-        purchase_df = data1[['Артикул ', 'Номенклатура', 'Коллекция', 'helper','В Пути','Рекомендательный Заказ']]
-        # Add the `on_the_way` column with a default value of 0
-        
-        #Separate DataFrames for each sheet]
-        overstock_df = data1[['Артикул ', 'Номенклатура', 'Коллекция', 'overstock']]
-        outofstock_df = data1[['Артикул ', 'Номенклатура', 'outofstock']]
-
-        # Add USD calculation column to outofstock_df
-        outofstock_df['USD of outofstock'] = ''  # Multiplied by E1 value placeholder
 
-        on_the_way = pd.DataFrame(columns = ['Артикул ', 'Номенклатура','В Пути'])
+        if forecast and batch:
+            await message.reply_text("Прогноз по истории продаж доступен только для одного файла.")
+            return
+        # History is kept per warehouse, named by the export's 'Склад: ...' line
+        warehouse = context.user_data.get('warehouse')
+        if forecast and not warehouse:
+            await message.reply_text("В выгрузке нет строки «Склад: …», поэтому прогноз по истории продаж недоступен.")
+            return
+
+        # Forecasts change with every day of history
+        report_key = (context.user_data.get('file_hash'), days, is_laminate, percentage,
+                      in_transit is not None and context.user_data.get('transit_hash'), live_formulas,
+                      forecast and (datetime.now().date().isoformat(), warehouse))
+        report = reports.get(report_key)
+        notes = " Продажи в день — прогноз по истории загрузок." if forecast else ""
+        if report is None and forecast:
+            # Daily sales from the trend and seasonality of past uploads, where the article has history
+            with trace.span("forecast") as span:
+                horizon = max(days) if isinstance(days, tuple) else days
+                data, known = await jobs.run(history.forecast_export, data, horizon, warehouse, notify=queue_notifier(message), span=span)
+                span.rows = len(data)
+            notes += f" Есть история: {known} из {len(data)} артикулов."
+        if report is not None:
+            logger.info(f"Using cached report for {report_key}. Cache: {reports.stats()}")
+        elif batch:
+            # Each file is calculated in parallel in the worker pool, then written into one workbook
+            async def calculate(frame):
+                with trace.span("calculate") as span:
+                    result = await jobs.run(compute_orders, frame, days, is_laminate, percentage, span=span)
+                    span.rows = len(result)
+                    return result
+
+            computed = await asyncio.gather(*(calculate(frame) for frame in batch.values()))
+            with trace.span("write") as span:
+                report = await jobs.run(build_batch_report, dict(zip(batch, computed)), notify=queue_notifier(message), span=span)
+                span.bytes_out = len(report)
+            reports.put(report_key, report)
+        elif isinstance(days, tuple):
+            # Scenario sweep: all periods from one pass over the frame, side by side in one workbook
+            with trace.span("calculate") as span:
+                computed = await jobs.run(compute_sweep, data, days, is_laminate, percentage, notify=queue_notifier(message), span=span)
+                span.rows = len(computed)
+            with trace.span("write") as span:
+                report = await jobs.run(render_sweep_report, computed, days, in_transit, live_formulas, span=span)
+                span.rows, span.bytes_out = len(computed), len(report)
+            reports.put(report_key, report)
+        else:
+            # Calculation and workbook build run in the worker pool
+            with trace.span("calculate") as span:
+                computed = await jobs.run(compute_orders, data, days, is_laminate, percentage, notify=queue_notifier(message), span=span)
+                span.rows = len(computed)
+            with trace.span("write") as span:
+                report = await jobs.run(render_report, computed, in_transit, live_formulas, span=span)
+                span.rows, span.bytes_out = len(computed), len(report)
+            reports.put(report_key, report)
+        output = BytesIO(report)
+
+        with trace.span("upload") as span:
+            await message.reply_document(
+                document=output,
+                filename="processed_batch.xlsx" if batch else "processed_scenarios.xlsx" if isinstance(days, tuple) else "processed_data.xlsx",
+                caption="📎Вот ваш обработанный файл." + (f" Учтены товары в пути: {len(in_transit)} артикулов." if in_transit is not None else "") + notes,
+                reply_markup=RERUN_MARKUP if batch else REPORT_MARKUP,
+            )
+            span.bytes_out = len(report)
+        activity.record_event(user.username or str(user.id), REPORT)
+        # The session stays until it expires, for the re-run button
 
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Write each DataFrame to its respective sheet
-            purchase_df.to_excel(writer, sheet_name='Рекомендательный Заказ', index=False)
-            overstock_df.to_excel(writer, sheet_name='Overstock', index=False)
-            outofstock_df.to_excel(writer, sheet_name='OutOfStock', index=False)
-            on_the_way.to_excel(writer, sheet_name='В Пути', index=False)
-
-            # Access the OutOfStock sheet to add fixed E1 value
-            workbook = writer.book
-            worksheet = writer.sheets['OutOfStock']
-            worksheet.write('E1', 1)  # Fixed cell value for USD multiplier
-            worksheet1 = writer.sheets["Рекомендательный Заказ"]
-            
-            # Write the formula for each row in the 'USD of outofstock' column
-            for row_num in range(1, len(outofstock_df) + 1):
-                formula = f'=C{row_num + 1}*$E$1'  # C column for outofstock, $E$1 for fixed value
-                worksheet.write_formula(row_num, 3, formula)  # Write formula in D column (USD of outofstock)
-            
-            # Write formulas to `total_purchase` column for dynamic calculation
-            for row_num in range(1, len(purchase_df) + 1):  # Starting from row 1 to avoid headers
-                worksheet1.write_formula(
-                    row_num, 5, f'=MAX(D{row_num + 1} - E{row_num + 1}, 0)'
-                )  # Ensure the result is not less than 0
+    except Exception:
+        logger.exception(f"Error processing file for {user.username} (ID: {user.id})")
+        await message.reply_text("Произошла непредвиденная ошибка при обработке файла.")
+    finally:
+        trace.finish()
 
-            for row_num in range(1, len(purchase_df) + 1):
-                worksheet1.write_formula(row_num - 1, 4, f'=iferror(VLOOKUP(A{row_num}, \'В Пути\'!A:C, 3, FALSE),0)')
 
+async def perf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the admin p50/p95 durations of the recent spans for each stage."""
+    if str(update.message.chat.id) != str(ADMIN_TELEGRAM_ID):
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
 
-        output.seek(0)
+    percentiles = registry.percentiles((0.5, 0.95))
+    if not percentiles:
+        await update.message.reply_text("No requests measured yet.")
+        return
+    lines = ["stage        n      p50      p95"]
+    for stage, (count, (p50, p95)) in sorted(percentiles.items()):
+        lines.append(f"{stage:<10} {count:>4} {p50:>7.3f}s {p95:>7.3f}s")
+    lines.append(f"\nQueued jobs: {jobs.waiting}. Peak RSS: {peak_rss() / 2**20:.0f} MiB.")
+    lines.append(f"Parse cache: {parsed_exports.stats()}. Report cache: {reports.stats()}.")
+    lines.append(f"Sessions: {sessions.stats()}.")
+    lines.append(f"History: {len(await asyncio.to_thread(history.days))} days of snapshots.")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def flush_activity_periodically() -> None:
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(activity.flush)
+        except Exception as e:
+            logger.error(f"Failed to save user activity: {e}")
+
+
+async def expire_sessions_periodically() -> None:
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_SECONDS)
+        expired = await asyncio.to_thread(sessions.expire)
+        if expired:
+            logger.info(f"Dropped {expired} idle sessions. Sessions: {sessions.stats()}")
+
+
+async def post_init(application: Application) -> None:
+    await asyncio.to_thread(activity.migrate_json, USER_ACTIVITY_FILE)
+    application.bot_data['activity_flusher'] = asyncio.get_running_loop().create_task(flush_activity_periodically())
+    await asyncio.to_thread(sessions.clear)  # Stale spill files of earlier runs
+    application.bot_data['session_sweeper'] = asyncio.get_running_loop().create_task(expire_sessions_periodically())
+    try:
+        application.bot_data['metrics_server'] = start_metrics_server()
+    except OSError as e:
+        logger.error(f"Failed to start the metrics endpoint: {e}")
 
-        await message.reply_document(document=output, filename="processed_data.xlsx", caption="📎Вот ваш обработанный файл.")
 
-    except Exception as e:
-        await message.reply_text("Произошла непредвиденная ошибка при обработке файла.")
-        print("Processing error:",e)
+async def post_shutdown(application: Application) -> None:
+    for task in ('activity_flusher', 'session_sweeper'):
+        task = application.bot_data.pop(task, None)
+        if task is not None:
+            task.cancel()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    await asyncio.to_thread(activity.close)
+    await asyncio.to_thread(sessions.clear)
+    jobs.shutdown()
 
 
 def main() -> None:
-    application = Application.builder().token(BOT_TOKEN).build()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    # Tables are needed before the persistence loads conversations, which happens ahead of post_init
+    activity.setup()
+    builder = (
+        Application.builder().token(BOT_TOKEN)
+        .persistence(DatabasePersistence(activity, transient_keys=['batch'], update_interval=PERSISTENCE_INTERVAL,
+                                         refresh=SHARED_STATE))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init).post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        api_url = TELEGRAM_API_URL.rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    application = builder.build()
 
     # Set up the conversation handler
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[
+            CommandHandler("start", start),
+            CallbackQueryHandler(rerun, pattern="^rerun$"),
+            CallbackQueryHandler(interruptible(rerun_forecast), pattern="^forecast$", block=False),
+        ],
         states={
             ASK_FILE: [
-                MessageHandler(filters.Document.FileExtension("xlsx"), handle_file),
+                MessageHandler(filters.Document.FileExtension("xlsx"), interruptible(handle_file), block=False),
                 MessageHandler(filters.CONTACT, handle_phone),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone),
+                CommandHandler("batch", start_batch),
+            ],
+            ASK_BATCH: [
+                MessageHandler(filters.Document.FileExtension("xlsx") | filters.Document.FileExtension("zip"), handle_batch_file),
+                CommandHandler("done", interruptible(finish_batch), block=False),
+            ],
+            ASK_DAYS: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_days),
+                MessageHandler(filters.Document.FileExtension("xlsx"), interruptible(handle_in_transit), block=False),
+                CallbackQueryHandler(choose_transit_mode, pattern="^transit_(values|formulas)$"),
+            ],
+            ASK_BRAND: [CallbackQueryHandler(interruptible(handle_brand), pattern="^(yes|no)$", block=False)],
+            ASK_PERCENTAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, interruptible(handle_percentage), block=False)],
+            # Heavy handlers run non-blocking; updates sent meanwhile get a "please wait" reply
+            ConversationHandler.WAITING: [
+                CommandHandler(["cancel", "start"], interrupt),
+                MessageHandler(filters.ALL, handle_busy),
+                CallbackQueryHandler(handle_busy),
             ],
-            ASK_DAYS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_days)],
-            ASK_BRAND: [CallbackQueryHandler(handle_brand)],
-            ASK_PERCENTAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_percentage)], 
         },
-        fallbacks=[CommandHandler("cancel", cancel)],  # Adding fallbacks for /cancel and /restart
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CallbackQueryHandler(rerun, pattern="^rerun$"),
+            CallbackQueryHandler(interruptible(rerun_forecast), pattern="^forecast$", block=False),
+        ],  # Adding fallbacks for /cancel and /restart
+        name="orders",
+        persistent=True,
     )
 
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("stats", stats))
-
-
-    # Run the bot using long polling
-    application.run_polling()
+    application.add_handler(CommandHandler("perf", perf))
+    if SHARED_STATE:
+        application.add_handler(TypeHandler(Update, functools.partial(load_shared_state, conv_handler)), group=-1)
+        application.add_handler(TypeHandler(Update, save_shared_state), group=1)
+
+
+    if WEBHOOK_URL:
+        # Telegram pushes updates to our HTTP server
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        # Run the bot using long polling
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
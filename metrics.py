@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "ks_orders"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(2**power for power in range(16, 32, 2))  # 64 KiB .. 1 GiB
+# Recent observations kept per stage for the /perf percentiles
+RECENT_SAMPLES = 1000
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """Current resident set size of this process in bytes, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _higher(first, second):
+    return None if first is None or second is None else max(first, second)
+
+
+def measure_call(func, *args, trace_memory: bool = False):
+    """Run `func(*args)` and return (result, seconds, RSS in bytes, peak memory in bytes or None).
+
+    Used inside pool workers, so the numbers describe the process that did the work.
+    The RSS is the higher of the current RSS before and after the call. With
+    `trace_memory` the peak of memory allocated during the call is traced with
+    tracemalloc (pandas and numpy buffers included); this slows the call down and
+    is only meaningful when nothing else runs in the process at the same time.
+    """
+    rss_before = current_rss()
+    tracing = trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if tracing else None
+    finally:
+        if tracing:
+            tracemalloc.stop()
+    return result, seconds, _higher(rss_before, current_rss()), peak
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Stage histograms and counters, exported in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (metric, stage) -> Histogram
+        self._counters = defaultdict(float)  # (metric, stage) -> value
+        self._recent = defaultdict(lambda: deque(maxlen=RECENT_SAMPLES))  # stage -> durations
+
+    def observe(self, metric: str, stage: str, value: float, buckets=SECONDS_BUCKETS) -> None:
+        with self._lock:
+            histogram = self._histograms.get((metric, stage))
+            if histogram is None:
+                histogram = self._histograms[(metric, stage)] = Histogram(buckets)
+            histogram.observe(value)
+            if metric == "stage_seconds":
+                self._recent[stage].append(value)
+
+    def inc(self, metric: str, stage: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[(metric, stage)] += value
+
+    def percentiles(self, quantiles=(0.5, 0.95)) -> dict:
+        """{stage: (sample count, [value per quantile])} over recent durations."""
+        with self._lock:
+            recent = {stage: sorted(values) for stage, values in self._recent.items()}
+        return {
+            stage: (len(values), [values[round(q * (len(values) - 1))] for q in quantiles])
+            for stage, values in recent.items() if values
+        }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (metric, stage), histogram in histograms:
+            name = f"{PREFIX}_{metric}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        for (metric, stage), value in counters:
+            name = f"{PREFIX}_{metric}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f'{name}{{stage="{stage}"}} {value:g}')
+        lines.append(f"# TYPE {PREFIX}_process_peak_rss_bytes gauge")
+        lines.append(f"{PREFIX}_process_peak_rss_bytes {peak_rss()}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Span:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.seconds = 0.0
+        self.rows = None
+        self.bytes_in = None
+        self.bytes_out = None
+        self.rss = None
+        self.peak_memory = None
+        self.wait_seconds = None
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {key: round(value, 4) if isinstance(value, float) else value
+                for key, value in vars(self).items() if value is not None}
+
+
+class Trace:
+    """Spans of one request; `finish` logs them as one JSON line and records the metrics."""
+
+    def __init__(self, kind: str, user: str = None):
+        self.kind = kind
+        self.user = user
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage: str):
+        span = Span(stage)
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            if not span.seconds:
+                span.seconds = time.perf_counter() - start
+            if span.rss is None:
+                span.rss = _higher(rss_before, current_rss())
+            self.add(span)
+
+    def add(self, span: Span) -> None:
+        self.spans.append(span)
+        registry.observe("stage_seconds", span.stage, span.seconds)
+        if span.rss is not None:
+            registry.observe("stage_rss_bytes", span.stage, span.rss, BYTES_BUCKETS)
+        if span.peak_memory is not None:
+            registry.observe("stage_peak_memory_bytes", span.stage, span.peak_memory, BYTES_BUCKETS)
+        registry.inc("stage_spans", span.stage)
+        if span.wait_seconds is not None:
+            registry.observe("stage_wait_seconds", span.stage, span.wait_seconds)
+        if span.rows is not None:
+            registry.inc("stage_rows", span.stage, span.rows)
+        if span.bytes_in is not None:
+            registry.inc("stage_bytes_in", span.stage, span.bytes_in)
+        if span.bytes_out is not None:
+            registry.inc("stage_bytes_out", span.stage, span.bytes_out)
+        if span.error is not None:
+            registry.inc("stage_errors", span.stage)
+
+    def finish(self) -> None:
+        logger.info("trace " + json.dumps({
+            "kind": self.kind,
+            "user": self.user,
+            "seconds": round(sum(span.seconds for span in self.spans), 4),
+            "spans": [span.as_dict() for span in self.spans],
+        }, ensure_ascii=False))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(host: str = None, port: int = None):
+    """Serve /metrics from a daemon thread; METRICS_PORT=0 disables it. Returns the server or None."""
+    host = host or os.environ.get("METRICS_HOST", "127.0.0.1")
+    port = int(os.environ.get("METRICS_PORT", 9100)) if port is None else port
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
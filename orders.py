@@ -0,0 +1,191 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from collection_matcher import CollectionMatcher, load_features
+from report import ON_THE_WAY_ROW, write_batch_report, write_report, write_sweep_report
+from schema import EXPORT_SCHEMA, match_header, to_frame
+
+# Columns of the 1C stock export used for the order calculation
+EXPORT_COLUMNS = [column.name for column in EXPORT_SCHEMA]
+
+FEATURES = ['ЕMR','EMR','YEL','WHT','ULT','SF','RUB','RED','PG','ORN','NC',
+            'LM','LAG','IND','GRN','GREY','FP STNX','FP PLC','FP NTR','CHR',
+            'BLU','BLA','AMB']
+
+# Optional file (JSON list or one code per line) overriding FEATURES, in priority order
+COLLECTIONS_FILE = os.environ.get("COLLECTIONS_FILE")
+
+collection_matcher = CollectionMatcher(load_features(COLLECTIONS_FILE) if COLLECTIONS_FILE else FEATURES)
+
+
+def export_frame(columns: list) -> pd.DataFrame:
+    """Cleaned export from the raw cells of the EXPORT_SCHEMA columns, in schema order.
+
+    '-Н' articles are dropped and the other rows converted to the schema dtypes.
+    """
+    # Dropping '-H' values; str() of one article at a time, so no text copy of the column is kept
+    keep = np.fromiter(("-Н" not in str(value) for value in columns[0]), dtype=bool, count=len(columns[0]))
+    if not keep.all():
+        columns = [np.asarray(values, dtype=object)[keep] for values in columns]
+    return to_frame(columns, EXPORT_SCHEMA)
+
+
+def clean_export(data: pd.DataFrame) -> pd.DataFrame:
+    """Select the needed columns of a raw pd.read_excel export and clean them for calculation.
+
+    Columns are found by their EXPORT_SCHEMA headers (SchemaError if any is missing).
+    ingest.read_export produces the same frame straight from the xlsx file.
+    """
+    positions = match_header(data.columns, EXPORT_SCHEMA)
+    # Drop the report preamble and footer rows
+    body = data.iloc[2:-2]
+    return export_frame([body.iloc[:, position].tolist() for position in positions])
+
+
+def add_collections(data: pd.DataFrame) -> pd.DataFrame:
+    """Return a copy of a cleaned export with the 'Коллекция' column filled in (as a category)."""
+    data = data.copy()
+    data['Коллекция'] = collection_matcher.classify(data['Номенклатура']).astype('category')
+    return data
+
+
+def compute_orders(data: pd.DataFrame, days: int, is_laminate: bool = False, percentage: float = 1) -> pd.DataFrame:
+    """Add period sales, purchase (helper), overstock and out-of-stock columns.
+
+    `data` is a cleaned export (clean_export or ingest.read_export). Every column is computed
+    with whole-column operations; the input frame is not modified.
+    """
+    result = data.copy()
+    daily_sales, stock, days_to_sell, days_since_sale = _order_inputs(data)
+    period_sales, helper, overstock = _period_orders(daily_sales, stock, days_to_sell, days, is_laminate, percentage)
+    result['Общый продажи период'] = period_sales
+    result['helper'] = helper
+    result['overstock'] = overstock
+    result['outofstock'] = np.where(stock <= 50, days_since_sale * daily_sales * percentage - stock, 0.0)
+    return result
+
+
+def compute_sweep(data: pd.DataFrame, days_list, is_laminate: bool = False, percentage: float = 1) -> pd.DataFrame:
+    """compute_orders for several periods at once, as side-by-side scenario columns.
+
+    The export columns are converted to arrays once. Each period gets its own period
+    sales, helper and overstock columns, named by sweep_column; 'outofstock' does not
+    depend on the period and appears once.
+    """
+    daily_sales, stock, days_to_sell, days_since_sale = _order_inputs(data)
+    columns = {}
+    for days in days_list:
+        period_sales, helper, overstock = _period_orders(daily_sales, stock, days_to_sell, days, is_laminate, percentage)
+        columns[sweep_column('Общый продажи период', days)] = period_sales
+        columns[sweep_column('helper', days)] = helper
+        columns[sweep_column('overstock', days)] = overstock
+    columns['outofstock'] = np.where(stock <= 50, days_since_sale * daily_sales * percentage - stock, 0.0)
+    return pd.concat([data, pd.DataFrame(columns, index=data.index)], axis=1)
+
+
+def sweep_column(column: str, days: int) -> str:
+    """Name of a compute_sweep column for one period."""
+    return f"{column} ({days} дн.)"
+
+
+def _order_inputs(data: pd.DataFrame):
+    """Daily sales, stock, days to sell and days since the last sale as arrays."""
+    return (data['Средние продажи день'].to_numpy(dtype=float), data['Остаток на конец'].to_numpy(dtype=float),
+            data['Дней на распродажи'].to_numpy(), data['Прошло дней от последней продажи'].to_numpy())
+
+
+def _period_orders(daily_sales, stock, days_to_sell, days: int, is_laminate: bool, percentage: float):
+    """Period sales, purchase (helper) and overstock for one period length."""
+    period_sales = daily_sales * days
+    if is_laminate:
+        # Adjust the average daily sales if it's Laminate
+        period_sales = period_sales * percentage
+
+    # Items that sell out within the period need purchasing, the rest are overstock
+    in_period = (days_to_sell >= 0) & (days_to_sell <= days)
+    return period_sales, np.where(in_period, period_sales - stock, 0.0), np.where(in_period, 0.0, stock - period_sales)
+
+
+def article_key(value) -> str:
+    """Key articles are matched on: text stripped, whole numbers without '.0' (100001.0 == '100001')."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def apply_in_transit(computed: pd.DataFrame, in_transit: pd.DataFrame) -> pd.DataFrame:
+    """Add the quantity in transit ('В Пути') of each article to a computed frame.
+
+    `in_transit` comes from ingest.read_in_transit (one row per article). Articles are
+    matched through a hash index of the in-transit keys; ON_THE_WAY_ROW holds the
+    matched in-transit row, or -1.
+    """
+    index = pd.Index([article_key(value) for value in in_transit['Артикул '].tolist()])
+    rows = index.get_indexer([article_key(value) for value in computed['Артикул '].tolist()])
+    # Row -1 picks the trailing 0 for articles with nothing in transit
+    quantities = np.append(in_transit['В Пути'].to_numpy(dtype=float), 0.0)
+    return computed.assign(**{'В Пути': quantities[rows], ON_THE_WAY_ROW: rows})
+
+
+def render_report(computed: pd.DataFrame, in_transit: pd.DataFrame = None, live_formulas: bool = False) -> bytes:
+    """Write a compute_orders frame as the report workbook and return its xlsx bytes.
+
+    With `in_transit`, the quantities in transit are subtracted and the order written
+    as values; `live_formulas` keeps formulas on the rows that have something in transit.
+    """
+    if in_transit is not None:
+        computed = apply_in_transit(computed, in_transit)
+    output = BytesIO()
+    write_report(computed, output, in_transit, live_formulas)
+    return output.getvalue()
+
+
+def build_report(data: pd.DataFrame, days: int, is_laminate: bool = False, percentage: float = 1,
+                 in_transit: pd.DataFrame = None, live_formulas: bool = False) -> bytes:
+    """Calculate orders for a cleaned, classified export and return the report as xlsx bytes."""
+    return render_report(compute_orders(data, days, is_laminate, percentage), in_transit, live_formulas)
+
+
+def render_sweep_report(computed: pd.DataFrame, days_list, in_transit: pd.DataFrame = None, live_formulas: bool = False) -> bytes:
+    """Write a compute_sweep frame as the scenario workbook and return its xlsx bytes (see render_report)."""
+    if in_transit is not None:
+        computed = apply_in_transit(computed, in_transit)
+    output = BytesIO()
+    scenarios = [(days, sweep_column('helper', days), sweep_column('overstock', days)) for days in days_list]
+    write_sweep_report(computed, scenarios, output, in_transit, live_formulas)
+    return output.getvalue()
+
+
+def consolidate_orders(results: dict) -> pd.DataFrame:
+    """Combine computed exports into one recommended order per article.
+
+    `results` maps file names to frames from build_batch_report; each file gets its
+    own quantity column and 'Итого' sums them. Articles are matched by article_key,
+    so 100001.0 in one export and '100001' in another are one row; the article, name
+    and collection shown are those of its first occurrence.
+    """
+    orders = pd.concat(
+        [frame[['Артикул ', 'Номенклатура', 'Коллекция']].assign(file=name, order=frame['Рекомендательный Заказ'])
+         for name, frame in results.items()],
+        ignore_index=True,
+    )
+    orders['key'] = [article_key(value) for value in orders['Артикул '].tolist()]
+    quantities = orders.pivot_table(index='key', columns='file', values='order', aggfunc='sum', fill_value=0)
+    quantities = quantities.reindex(columns=list(results))
+    labels = orders.drop_duplicates('key').set_index('key')[['Артикул ', 'Номенклатура', 'Коллекция']]
+    consolidated = labels.join(quantities, how='right')
+    consolidated['Итого'] = quantities.sum(axis=1)
+    return consolidated.reset_index(drop=True)
+
+
+def build_batch_report(results: dict) -> bytes:
+    """Build the combined workbook for several exports ({name: compute_orders frame}) as xlsx bytes."""
+    # Nothing is known to be in transit, so the recommended order is the purchase floored at 0
+    results = {name: frame.assign(**{'Рекомендательный Заказ': frame['helper'].clip(lower=0)})
+               for name, frame in results.items()}
+    output = BytesIO()
+    write_batch_report(results, consolidate_orders(results), output)
+    return output.getvalue()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import pickle
+
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+USER_DATA = "user_data"
+CONVERSATION = "conversation:"
+
+
+class DatabasePersistence(BasePersistence):
+    """python-telegram-bot persistence for user data and conversation states.
+
+    State is pickled into the `bot_state` table of the activity store (SQLite or
+    PostgreSQL), so conversations survive restarts and deploys. Values under
+    `transient_keys` (e.g. running asyncio tasks) are kept out of the database.
+    Chat, bot and callback data are not persisted. Writes go straight to the
+    database when PTB hands them over, which it does every `update_interval`
+    seconds and whenever the bot calls `Application.update_persistence`.
+
+    With `refresh=True` several bot processes can serve the bot together: before
+    each update the user's data, and with `refresh_conversation` their conversation
+    state, are read back from the database, and taken over if another process has
+    written them since this one last read or wrote them. Otherwise PTB reads state
+    only at startup and one bot process at a time may use the database.
+    """
+
+    def __init__(self, store, transient_keys=(), update_interval: float = 60, refresh: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.transient_keys = set(transient_keys)
+        self.refresh = refresh
+        self._seen = {}  # (kind, key) -> value bytes this process last read from or wrote to the database
+
+    async def get_user_data(self) -> dict:
+        stored = await asyncio.to_thread(self.store.load_state, USER_DATA)
+        self._seen.update(((USER_DATA, user_id), value) for user_id, value in stored.items())
+        return {int(user_id): pickle.loads(value) for user_id, value in stored.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        data = {key: value for key, value in data.items() if key not in self.transient_keys}
+        await self._save(USER_DATA, str(user_id), pickle.dumps(data))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._save(USER_DATA, str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if not self.refresh:
+            return
+        changed, value = await self._changed(USER_DATA, str(user_id))
+        if changed:
+            # Transient values belong to this process and stay
+            for key in [key for key in user_data if key not in self.transient_keys]:
+                del user_data[key]
+            user_data.update(pickle.loads(value) if value is not None else {})
+
+    async def get_conversations(self, name: str) -> dict:
+        stored = await asyncio.to_thread(self.store.load_state, CONVERSATION + name)
+        self._seen.update(((CONVERSATION + name, key), state) for key, state in stored.items())
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in stored.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object) -> None:
+        await self._save(CONVERSATION + name, json.dumps(list(key)), None if new_state is None else pickle.dumps(new_state))
+
+    async def refresh_conversation(self, handler: ConversationHandler, key: tuple) -> None:
+        """Take the state of one conversation of a persistent `handler` from the database if it changed there.
+
+        PTB has no hook for this; call it before the handler sees the update.
+        """
+        if not self.refresh:
+            return
+        changed, value = await self._changed(CONVERSATION + handler.name, json.dumps(list(key)))
+        if changed:
+            # Not tracked as a change, so it is not written back
+            conversations = handler._conversations
+            if value is None:
+                conversations.data.pop(key, None)
+            else:
+                conversations.update_no_track({key: pickle.loads(value)})
+
+    async def _changed(self, kind: str, key: str):
+        """(True, stored value or None) if the database holds another value than this process last saw, else (False, None)."""
+        value = await asyncio.to_thread(self.store.load_state_value, kind, key)
+        if value == self._seen.get((kind, key)):
+            return False, None
+        self._seen[(kind, key)] = value
+        return True, value
+
+    async def _save(self, kind: str, key: str, value: bytes = None) -> None:
+        # PTB hands over everything an update touched; rewriting what this process last saw
+        # would only undo changes another process made meanwhile
+        if value == self._seen.get((kind, key)):
+            return
+        await asyncio.to_thread(self.store.save_state, kind, key, value)
+        self._seen[(kind, key)] = value
+
+    # Chat, bot and callback data are not stored (see store_data)
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
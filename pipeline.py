@@ -0,0 +1,86 @@
+"""Library entry point for the order calculation, usable without Telegram.
+
+    from pipeline import process_export
+    report = process_export("export.xlsx", days=30, is_laminate=True, percentage=0.8)
+
+pandas, openpyxl and XlsxWriter are only imported when a function is called, so
+importing this module stays cheap. The bot runs the same ingest/orders code.
+"""
+import os
+from io import BytesIO
+
+
+def export_name(path: str) -> str:
+    """Name used for an export in batch reports: the file name without extension."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load(source):
+    """Read an export (path or binary file object) into a cleaned, classified DataFrame."""
+    from ingest import load_export
+    return load_export(source)
+
+
+def load_in_transit(source):
+    """Read an in-transit file (path or binary file object): one row per article with its 'В Пути' quantity."""
+    from ingest import read_in_transit
+    return read_in_transit(source)
+
+
+def history_warehouse(found: str, warehouse: str = None) -> str:
+    """Warehouse whose sales history an export belongs to: `warehouse` if given, else the one named in the export.
+
+    Raises ValueError if there is neither, since exports of unknown warehouses must not share a history.
+    """
+    if not (warehouse or found):
+        raise ValueError("The export names no warehouse ('Склад: ...' line); give one explicitly")
+    return warehouse or found
+
+
+def record_snapshot(source, day=None, directory: str = None, warehouse: str = None) -> str:
+    """Add an export (path or binary file object) to the sales history of its warehouse; returns the snapshot path.
+
+    The warehouse is read from the export's 'Склад: ...' line unless `warehouse` is
+    given; forecasts use only snapshots of their own warehouse. Snapshots are named by
+    the file's content hash, so recording a file twice for the same day keeps one copy.
+    """
+    from cache import content_hash
+    from history import HistoryStore
+    from ingest import read_export_with_warehouse
+    if hasattr(source, 'read'):
+        content = source.read()
+    else:
+        with open(source, 'rb') as file:
+            content = file.read()
+    data, found = read_export_with_warehouse(BytesIO(content))
+    store = HistoryStore(directory) if directory else HistoryStore()
+    return store.record(data, content_hash(content), history_warehouse(found, warehouse), day)
+
+
+def process_export(source, days: int, is_laminate: bool = False, percentage: float = 1,
+                   in_transit=None, live_formulas: bool = False, forecast: bool = False, warehouse: str = None) -> bytes:
+    """Read one export and return its order report as xlsx bytes.
+
+    `in_transit` is an in-transit file or a load_in_transit frame; its quantities are
+    subtracted from the order, as values unless `live_formulas` is set. With `forecast`
+    the daily sales come from the sales history (history.HistoryStore) of the export's
+    warehouse, or of `warehouse` if given, where it has the article.
+    """
+    from orders import build_report
+    if in_transit is not None and not hasattr(in_transit, 'columns'):
+        in_transit = load_in_transit(in_transit)
+    if forecast:
+        from history import HistoryStore
+        from ingest import read_export_with_warehouse
+        from orders import add_collections
+        data, found = read_export_with_warehouse(source)
+        data, _ = HistoryStore().forecast_export(add_collections(data), days, history_warehouse(found, warehouse))
+    else:
+        data = load(source)
+    return build_report(data, days, is_laminate, percentage, in_transit, live_formulas)
+
+
+def process_batch(frames: dict, days: int, is_laminate: bool = False, percentage: float = 1) -> bytes:
+    """Return one combined report for several loaded exports ({name: DataFrame})."""
+    from orders import build_batch_report, compute_orders
+    return build_batch_report({name: compute_orders(data, days, is_laminate, percentage) for name, data in frames.items()})
@@ -0,0 +1,245 @@
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+PURCHASE_SHEET = 'Рекомендательный Заказ'
+OVERSTOCK_SHEET = 'Overstock'
+OUTOFSTOCK_SHEET = 'OutOfStock'
+ON_THE_WAY_SHEET = 'В Пути'
+CONSOLIDATED_SHEET = 'Сводный Заказ'
+
+# Columns of each file's sheet in a batch report
+BATCH_FILE_COLUMNS = ['Артикул ', 'Номенклатура', 'Коллекция', 'helper', 'overstock', 'outofstock', 'Рекомендательный Заказ']
+
+# Defined name for the 'В Пути' columns the purchase lookups search. Whole columns, as
+# the original 'В Пути'!A:C, so a pasted in-transit list of any length is found. Each
+# lookup is still an exact-match VLOOKUP over the filled rows, no cheaper than before:
+# the list is pasted unsorted, which rules out approximate match, and XlsxWriter has
+# no tables in constant_memory mode.
+ON_THE_WAY_RANGE = 'on_the_way'
+# Column set by orders.apply_in_transit: row of the article in the in-transit frame, or -1
+ON_THE_WAY_ROW = 'В Пути строка'
+
+# Same look as the header pandas' to_excel writes
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+
+def _write_header(worksheet, columns, header_format) -> None:
+    for col, name in enumerate(columns):
+        worksheet.write_string(0, col, name, header_format)
+
+
+def _sheet_name(name: str, used: set) -> str:
+    """Excel-safe, unique sheet name (at most 31 characters, no []:*?/\\)."""
+    base = ''.join('_' if char in '[]:*?/\\' else char for char in name).strip().strip("'") or 'Sheet'
+    base = base[:31]
+    candidate, number = base, 1
+    while candidate.lower() in used:
+        number += 1
+        suffix = f' ({number})'
+        candidate = base[:31 - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+
+def _new_workbook(output):
+    return xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True,
+    })
+
+
+def _write_outofstock_sheet(workbook, articles, names, outofstock, header_format) -> None:
+    # Out of stock: D = C * $E$1, with the USD multiplier in E1
+    worksheet = workbook.add_worksheet(OUTOFSTOCK_SHEET)
+    _write_header(worksheet, ['Артикул ', 'Номенклатура', 'outofstock', 'USD of outofstock'], header_format)
+    worksheet.write_number(0, 4, 1)  # Fixed cell value for USD multiplier
+    for row, (article, name, value) in enumerate(zip(articles, names, outofstock), start=1):
+        worksheet.write(row, 0, article)
+        worksheet.write(row, 1, name)
+        worksheet.write_number(row, 2, value)
+        worksheet.write_formula(row, 3, f'=C{row + 1}*$E$1', None, value)
+
+
+def _write_on_the_way_sheet(workbook, header_format, in_transit=None) -> None:
+    worksheet = workbook.add_worksheet(ON_THE_WAY_SHEET)
+    if in_transit is not None:
+        _write_frame(worksheet, in_transit, ['Артикул ', 'Номенклатура', 'В Пути'], header_format)
+    else:
+        # Left empty for the user to fill in
+        _write_header(worksheet, ['Артикул ', 'Номенклатура', 'В Пути'], header_format)
+    workbook.define_name(ON_THE_WAY_RANGE, f"='{ON_THE_WAY_SHEET}'!$A:$C")
+
+
+def _on_the_way_cells(data, in_transit, live_formulas: bool):
+    """(quantity, formula or None) of the 'В Пути' cell for every purchase row.
+
+    Without in-transit data every row looks its article up in the 'В Пути' sheet for
+    the user to fill in. With it the quantity is a value, or with `live_formulas` a
+    direct reference to the matched row of the 'В Пути' sheet (unmatched rows stay values).
+    """
+    rows = len(data)
+    if in_transit is None:
+        return ((0.0, f'=IFERROR(VLOOKUP(A{row + 1},{ON_THE_WAY_RANGE},3,FALSE),0)') for row in range(1, rows + 1))
+    quantities = data['В Пути'].tolist()
+    if not live_formulas:
+        return ((quantity, None) for quantity in quantities)
+    return ((quantity, f"='{ON_THE_WAY_SHEET}'!C{match + 2}" if match >= 0 else None)
+            for quantity, match in zip(quantities, data[ON_THE_WAY_ROW].tolist()))
+
+
+def _write_order(worksheet, row: int, col: int, helper: float, on_the_way, helper_col: str, on_the_way_col: str) -> None:
+    # Recommended order = MAX(helper - В Пути, 0); a formula only where В Пути is one
+    quantity, formula = on_the_way
+    value = max(helper - quantity, 0)
+    if formula is None:
+        worksheet.write_number(row, col, value)
+    else:
+        worksheet.write_formula(row, col, f'=MAX({helper_col}{row + 1}-{on_the_way_col}{row + 1},0)', None, value)
+
+
+def _write_on_the_way(worksheet, row: int, col: int, on_the_way) -> None:
+    quantity, formula = on_the_way
+    if formula is None:
+        worksheet.write_number(row, col, quantity)
+    else:
+        worksheet.write_formula(row, col, formula, None, quantity)
+
+
+def _write_frame(worksheet, frame, columns, header_format) -> None:
+    _write_header(worksheet, columns, header_format)
+    for row, values in enumerate(frame[columns].itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row, 0, values)
+
+
+def write_report(data, output, in_transit=None, live_formulas: bool = False) -> None:
+    """Write the order workbook for a frame produced by orders.compute_orders.
+
+    `output` is a file name or a binary file object. The workbook is written in
+    XlsxWriter's constant_memory mode: every sheet is written row by row, values
+    and formulas together, and each finished row is flushed to a temporary file
+    instead of staying in memory.
+
+    `in_transit` (ingest.read_in_transit, with `data` passed through
+    orders.apply_in_transit) fills the 'В Пути' sheet and the purchase rows;
+    see _on_the_way_cells for `live_formulas`.
+    """
+    workbook = _new_workbook(output)
+    header_format = workbook.add_format(HEADER_FORMAT)
+
+    articles = data['Артикул '].tolist()
+    names = data['Номенклатура'].tolist()
+    collections = data['Коллекция'].tolist()
+
+    # Recommended order: E is the quantity in transit, F = MAX(D - E, 0)
+    worksheet = workbook.add_worksheet(PURCHASE_SHEET)
+    _write_header(worksheet, ['Артикул ', 'Номенклатура', 'Коллекция', 'helper', 'В Пути', 'Рекомендательный Заказ'], header_format)
+    on_the_way = _on_the_way_cells(data, in_transit, live_formulas)
+    for row, (article, name, collection, helper, cell) in enumerate(
+            zip(articles, names, collections, data['helper'].tolist(), on_the_way), start=1):
+        worksheet.write(row, 0, article)
+        worksheet.write(row, 1, name)
+        worksheet.write_string(row, 2, collection)
+        worksheet.write_number(row, 3, helper)
+        _write_on_the_way(worksheet, row, 4, cell)
+        _write_order(worksheet, row, 5, helper, cell, 'D', 'E')
+
+    worksheet = workbook.add_worksheet(OVERSTOCK_SHEET)
+    _write_header(worksheet, ['Артикул ', 'Номенклатура', 'Коллекция', 'overstock'], header_format)
+    for row, (article, name, collection, overstock) in enumerate(zip(articles, names, collections, data['overstock'].tolist()), start=1):
+        worksheet.write(row, 0, article)
+        worksheet.write(row, 1, name)
+        worksheet.write_string(row, 2, collection)
+        worksheet.write_number(row, 3, overstock)
+
+    _write_outofstock_sheet(workbook, articles, names, data['outofstock'].tolist(), header_format)
+    _write_on_the_way_sheet(workbook, header_format, in_transit)
+    workbook.close()
+
+
+def write_sweep_report(data, scenarios, output, in_transit=None, live_formulas: bool = False) -> None:
+    """Write several order scenarios side by side, for a frame from orders.compute_sweep.
+
+    `scenarios` lists (days, helper column, overstock column). The purchase sheet has
+    one 'В Пути' cell per row and, for each scenario, its helper and a recommended
+    order = MAX(helper - В Пути, 0); the overstock sheet has one column per scenario.
+    `in_transit` and `live_formulas` are as for write_report.
+    """
+    workbook = _new_workbook(output)
+    header_format = workbook.add_format(HEADER_FORMAT)
+
+    articles = data['Артикул '].tolist()
+    names = data['Номенклатура'].tolist()
+    collections = data['Коллекция'].tolist()
+
+    worksheet = workbook.add_worksheet(PURCHASE_SHEET)
+    columns = ['Артикул ', 'Номенклатура', 'Коллекция', 'В Пути']
+    for days, helper, _ in scenarios:
+        columns += [helper, f'Рекомендательный Заказ ({days} дн.)']
+    _write_header(worksheet, columns, header_format)
+    helpers = [data[helper].tolist() for _, helper, _ in scenarios]
+    letters = [xl_col_to_name(4 + 2 * i) for i in range(len(scenarios))]
+    on_the_way = _on_the_way_cells(data, in_transit, live_formulas)
+    for row, (article, name, collection, cell, *values) in enumerate(
+            zip(articles, names, collections, on_the_way, *helpers), start=1):
+        worksheet.write(row, 0, article)
+        worksheet.write(row, 1, name)
+        worksheet.write_string(row, 2, collection)
+        _write_on_the_way(worksheet, row, 3, cell)
+        for i, (letter, helper) in enumerate(zip(letters, values)):
+            worksheet.write_number(row, 4 + 2 * i, helper)
+            _write_order(worksheet, row, 5 + 2 * i, helper, cell, letter, 'D')
+
+    worksheet = workbook.add_worksheet(OVERSTOCK_SHEET)
+    _write_header(worksheet, ['Артикул ', 'Номенклатура', 'Коллекция'] + [overstock for _, _, overstock in scenarios], header_format)
+    overstocks = [data[overstock].tolist() for _, _, overstock in scenarios]
+    for row, (article, name, collection, *values) in enumerate(zip(articles, names, collections, *overstocks), start=1):
+        worksheet.write(row, 0, article)
+        worksheet.write(row, 1, name)
+        worksheet.write_string(row, 2, collection)
+        worksheet.write_row(row, 3, values)
+
+    _write_outofstock_sheet(workbook, articles, names, data['outofstock'].tolist(), header_format)
+    _write_on_the_way_sheet(workbook, header_format, in_transit)
+    workbook.close()
+
+
+def write_batch_report(results: dict, consolidated, output) -> None:
+    """Write a batch report: the consolidated order first, then one sheet per file.
+
+    `results` maps file names to orders.compute_orders frames and `consolidated` is
+    the orders.consolidate_orders frame for them.
+    """
+    workbook = _new_workbook(output)
+    header_format = workbook.add_format(HEADER_FORMAT)
+    used = {CONSOLIDATED_SHEET.lower()}
+
+    worksheet = workbook.add_worksheet(CONSOLIDATED_SHEET)
+    _write_frame(worksheet, consolidated, list(consolidated.columns), header_format)
+
+    for name, frame in results.items():
+        worksheet = workbook.add_worksheet(_sheet_name(name, used))
+        _write_frame(worksheet, frame, BATCH_FILE_COLUMNS, header_format)
+
+    workbook.close()
+
+
+def write_table(output, sheet_name: str, columns, rows) -> int:
+    """Write `rows` (any iterable of tuples) under a header to a single-sheet workbook.
+
+    Rows are consumed one at a time in constant_memory mode, so a database cursor
+    can be streamed straight into the file. Returns the number of rows written.
+    """
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    _write_header(worksheet, columns, workbook.add_format(HEADER_FORMAT))
+    count = 0
+    for count, values in enumerate(rows, start=1):
+        worksheet.write_row(count, 0, values)
+    workbook.close()
+    return count
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# What 1C writes for "never" (e.g. days to sell of an item without sales); read as INFINITY_VALUE
+INFINITY = '∞'
+INFINITY_VALUE = -1
+
+# Text columns with few distinct values, stored as categories
+CATEGORY_COLUMNS = ['Коллекция']
+
+
+class SchemaError(ValueError):
+    """A file's header lacks required columns; `missing` lists their names."""
+
+    def __init__(self, message: str, missing=()):
+        super().__init__(message)
+        self.missing = list(missing)
+
+    def __reduce__(self):
+        # Keeps `missing` when the error comes back from a worker process
+        return type(self), (str(self), self.missing)
+
+
+def normalize(header) -> str:
+    """Header text as compared with a Column's aliases: case, 'ё' and spacing ignored."""
+    return ' '.join(str(header).replace('ё', 'е').replace('Ё', 'Е').split()).lower()
+
+
+class Column:
+    """A column of an uploaded file: its name in the frame, accepted headers and dtype.
+
+    `dtype` is 'text', 'int32' or 'float32'; a float32 column stays float64 when
+    float32 would change any of its values, so calculations never see rounded numbers.
+    Empty cells become `empty`. Optional columns may be missing from the header.
+    """
+
+    def __init__(self, name: str, aliases=(), dtype: str = 'text', empty=None, required: bool = True):
+        self.name = name
+        self.aliases = [normalize(alias) for alias in (name, *aliases)]
+        self.dtype = dtype
+        self.empty = ('' if dtype == 'text' else 0) if empty is None else empty
+        self.required = required
+
+    def coerce(self, values) -> pd.Series:
+        """Convert the raw cells of this column in one pass.
+
+        Numbers pass through, numbers written as text have their spaces removed,
+        INFINITY is read as INFINITY_VALUE and empty cells as `empty`. Raises ValueError naming the
+        column and the first cell that is not a number.
+        """
+        series = pd.Series(values, dtype=object)
+        if self.dtype == 'text':
+            return series.where(series.notna(), self.empty)
+
+        numbers = pd.to_numeric(series, errors='coerce')
+        # Left over: text such as '1 234' or '∞', and anything that is not a number
+        rest = numbers.isna() & series.notna()
+        if rest.any():
+            text = series[rest].astype(str).str.replace(r'\s', '', regex=True)
+            fixed = pd.to_numeric(text.replace({INFINITY: str(INFINITY_VALUE), '': str(self.empty)}), errors='coerce')
+            if fixed.isna().any():
+                raise ValueError(f"Column '{self.name.strip()}': {series[rest][fixed.isna()].iloc[0]!r} is not a number")
+            numbers[rest] = fixed
+        numbers = numbers.fillna(self.empty).to_numpy()
+
+        if self.dtype == 'int32':
+            return pd.Series(numbers.astype('int32'))
+        numbers = numbers.astype('float64')
+        compact = numbers.astype('float32')
+        return pd.Series(compact if np.array_equal(compact, numbers) else numbers)
+
+
+# Columns of the 1C stock export used for the order calculation, in frame order
+EXPORT_SCHEMA = [
+    Column('Артикул ', empty=0),
+    Column('Номенклатура', ['Наименование', 'Товар']),
+    Column('Дней на распродажи', ['Дней на распродажу'], 'int32'),
+    Column('Остаток на конец', ['Конечный остаток'], 'float32'),
+    Column('Средние продажи день', ['Средние продажи в день'], 'float32'),
+    Column('Прошло дней от последней продажи', ['Дней от последней продажи'], 'int32'),
+]
+
+# Columns of an in-transit file (ingest.read_in_transit)
+IN_TRANSIT_SCHEMA = [
+    Column('Артикул '),
+    Column('Номенклатура', required=False),
+    Column('В Пути', ['Количество', 'Кол-во'], 'float32'),
+]
+
+
+def match_header(header, schema: list) -> list:
+    """Position of every schema column in a header row, None for missing optional columns.
+
+    Raises SchemaError naming the required columns the header lacks.
+    """
+    names = ['' if cell is None else normalize(cell) for cell in header]
+    positions = [next((names.index(alias) for alias in column.aliases if alias in names), None) for column in schema]
+    missing = [column.name.strip() for column, position in zip(schema, positions) if position is None and column.required]
+    if missing:
+        raise SchemaError(f"Missing columns: {', '.join(missing)}", missing)
+    return positions
+
+
+def to_frame(columns: list, schema: list) -> pd.DataFrame:
+    """DataFrame of raw cell lists (one per schema column, None for absent ones) in the schema dtypes."""
+    length = max((len(values) for values in columns if values is not None), default=0)
+    return pd.DataFrame({
+        column.name: column.coerce([None] * length if values is None else values)
+        for column, values in zip(schema, columns)
+    })
@@ -0,0 +1,240 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from schema import CATEGORY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Where sessions over the memory budget are spilled
+SESSION_DIR = os.environ.get("SESSION_DIR") or os.path.join(tempfile.gettempdir(), "ks-orders-sessions")
+# Memory for pending uploads of all users together; least recently used sessions are spilled beyond it
+SESSION_MEMORY_MB = int(os.environ.get("SESSION_MEMORY_MB", 128))
+# Sessions idle longer than this are dropped (seconds)
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 30 * 60))
+
+
+def compact_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Downcast integer columns and store repeated labels as categories; the values are unchanged."""
+    columns = {}
+    for column in data.columns:
+        series = data[column]
+        if pd.api.types.is_integer_dtype(series.dtype):
+            columns[column] = pd.to_numeric(series, downcast='integer')
+        elif column in CATEGORY_COLUMNS and not isinstance(series.dtype, pd.CategoricalDtype):
+            columns[column] = series.astype('category')
+    return data.assign(**columns) if columns else data
+
+
+def frame_size(value) -> int:
+    """Memory used by a DataFrame or a {name: DataFrame} dict, in bytes."""
+    if isinstance(value, dict):
+        return sum(frame_size(frame) for frame in value.values())
+    return int(value.memory_usage(index=True, deep=True).sum())
+
+
+class SessionStore:
+    """Pending uploads per user (a DataFrame or a {name: DataFrame} batch).
+
+    Up to `memory_budget` bytes are kept in memory; beyond that the least recently
+    used sessions are pickled to `directory` and loaded back when the user continues.
+    Sessions idle for `ttl` seconds are dropped by `expire`. Safe to use from threads.
+    Sessions live in the process that holds the store; spill file names carry the
+    process id, so processes sharing `directory` never touch each other's files
+    (SharedSessionStore shares the sessions themselves).
+    """
+
+    def __init__(self, directory: str = SESSION_DIR, memory_budget: int = SESSION_MEMORY_MB * 2**20, ttl: float = SESSION_TTL):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # key -> [value or None if spilled, size, last used]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[2] <= self.ttl
+
+    def keys(self, prefix: str = "") -> list:
+        """Keys of the sessions whose key, as text, starts with `prefix`."""
+        with self._lock:
+            return [key for key in self._entries if str(key).startswith(prefix)]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._remove(key)
+            size = frame_size(value)
+            self._entries[key] = [value, size, time.monotonic()]
+            self.size += size
+            self._spill_over_budget()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                return default
+            if entry[0] is None:
+                path = self._path(key)
+                entry[0] = pd.read_pickle(path)
+                os.remove(path)
+                self.size += entry[1]
+            value = entry[0]
+            entry[2] = time.monotonic()
+            self._entries.move_to_end(key)
+            self._spill_over_budget()
+            return value
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def expire(self) -> int:
+        """Drop sessions idle for longer than the TTL; returns how many were dropped."""
+        with self._lock:
+            deadline = time.monotonic() - self.ttl
+            expired = [key for key, entry in self._entries.items() if entry[2] < deadline]
+            for key in expired:
+                self._remove(key)
+        return len(expired)
+
+    def clear(self) -> None:
+        """Drop all sessions, and spill files of other runs idle for longer than the TTL."""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            if os.path.isdir(self.directory):
+                # Newer files may belong to another live process using the same directory
+                deadline = time.time() - self.ttl
+                for entry in os.scandir(self.directory):
+                    if entry.name.endswith(".pkl") and entry.stat().st_mtime < deadline:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            spilled = sum(1 for entry in self._entries.values() if entry[0] is None)
+        return {"sessions": len(self._entries), "spilled": spilled, "size": self.size}
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}-{key}.pkl")
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry[0] is None:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        else:
+            self.size -= entry[1]
+
+    def _spill_over_budget(self) -> None:
+        # Oldest first; the most recent session is spilled too if it alone is over the budget
+        for key, entry in self._entries.items():
+            if self.size <= self.memory_budget:
+                break
+            if entry[0] is None:
+                continue
+            os.makedirs(self.directory, exist_ok=True)
+            pd.to_pickle(entry[0], self._path(key))
+            entry[0] = None
+            self.size -= entry[1]
+            logger.info(f"Spilled session {key} ({entry[1]} bytes) to disk")
+
+
+class SharedSessionStore(SessionStore):
+    """Sessions kept only as files in `directory`, for bot processes sharing it.
+
+    Every put writes the session's pickle (atomically, so no process reads half a
+    file) and every get reads it back, so whichever process receives the user's
+    next update continues the session. A file's modification time is the session's
+    last use. Nothing is held in memory, so there is no memory budget.
+    """
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __contains__(self, key) -> bool:
+        try:
+            return time.time() - os.stat(self._path(key)).st_mtime <= self.ttl
+        except FileNotFoundError:
+            return False
+
+    def keys(self, prefix: str = "") -> list:
+        """Keys of the sessions in the directory whose (text) key starts with `prefix`."""
+        if not os.path.isdir(self.directory):
+            return []
+        return [entry.name[:-len(".pkl")] for entry in os.scandir(self.directory)
+                if entry.name.endswith(".pkl") and entry.name.startswith(prefix)]
+
+    def put(self, key, value) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        pd.to_pickle(value, temporary)
+        os.replace(temporary, path)
+
+    def get(self, key, default=None):
+        if key not in self:
+            self.discard(key)
+            return default
+        path = self._path(key)
+        try:
+            value = pd.read_pickle(path)
+            os.utime(path)
+        except FileNotFoundError:  # Discarded by another process meanwhile
+            return default
+        return value
+
+    def discard(self, key) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def expire(self) -> int:
+        """Remove session files (and leftover temporary files) idle for longer than the TTL."""
+        if not os.path.isdir(self.directory):
+            return 0
+        deadline, expired = time.time() - self.ttl, 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith((".pkl", ".tmp")) and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    expired += 1
+            except FileNotFoundError:
+                pass
+        return expired
+
+    def clear(self) -> None:
+        """Remove idle session files only; the others may belong to a live process."""
+        self.expire()
+
+    def stats(self) -> dict:
+        sizes = []
+        for key in self.keys():
+            try:
+                sizes.append(os.stat(self._path(key)).st_size)
+            except FileNotFoundError:
+                pass
+        return {"sessions": len(sizes), "spilled": len(sizes), "size": sum(sizes)}
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
@@ -0,0 +1,124 @@
+"""A minimal fake Telegram Bot API server for running the bot locally.
+
+It answers the Bot API methods the bot calls, records every call with its
+parameters and serves registered files to getFile downloads. Point the bot at
+it with TELEGRAM_API_URL=<server.url>:
+
+    telegram = FakeTelegram().start()
+    telegram.files["export"] = open("export.xlsx", "rb").read()
+"""
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "ks_orders_test_bot"}
+
+
+def _parse_body(content_type: str, body: bytes) -> dict:
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+    if content_type.startswith("multipart/form-data"):
+        # sendDocument: uploaded files come back as bytes, other fields as text
+        message = BytesParser(policy=default).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            params[name] = part.get_payload(decode=True) if part.get_filename() else part.get_content()
+        return params
+    return {}
+
+
+class FakeTelegram:
+    """Bot API server on `url`; `calls` lists (method, params) in the order they arrived."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.files = {}  # file_id -> bytes served for getFile
+        self.calls = []
+        self._condition = threading.Condition()
+        self._message_id = 1000
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.url = f"http://{host}:{self.server.server_port}"
+
+    def start(self) -> "FakeTelegram":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for(self, method: str, contains: str = None, timeout: float = 60) -> dict:
+        """Parameters of the first `method` call whose text or caption contains `contains`."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for called, params in self.calls:
+                    text = str(params.get("text") or params.get("caption") or "")
+                    if called == method and (contains is None or contains in text):
+                        return params
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AssertionError(f"No {method} call{f' with {contains!r}' if contains else ''}; calls: "
+                                         f"{[(called, str(params.get('text', ''))[:40]) for called, params in self.calls]}")
+                self._condition.wait(remaining)
+
+    def count(self, method: str) -> int:
+        with self._condition:
+            return sum(1 for called, _ in self.calls if called == method)
+
+    def _answer(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": f"u-{file_id}",
+                    "file_size": len(self.files.get(file_id, b"")), "file_path": file_id}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            with self._condition:
+                self._message_id += 1
+                message_id = self._message_id
+            message = {"message_id": message_id, "date": int(time.time()),
+                       "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}
+            if method == "sendDocument":
+                message["document"] = {"file_id": f"sent-{message_id}", "file_unique_id": f"sent-{message_id}"}
+            else:
+                message["text"] = str(params.get("text", ""))
+            return message
+        return True
+
+    def _handler(self):
+        telegram = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # File downloads: /file/bot<token>/<file_path>
+                content = telegram.files.get(self.path.rsplit("/", 1)[-1])
+                self.send_response(200 if content is not None else 404)
+                self.end_headers()
+                self.wfile.write(content or b"")
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                params = _parse_body(self.headers.get("Content-Type", ""), body)
+                result = telegram._answer(method, params)
+                with telegram._condition:
+                    telegram.calls.append((method, params))
+                    telegram._condition.notify_all()
+                out = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        return Handler
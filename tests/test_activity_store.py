@@ -0,0 +1,128 @@
+"""The activity store's SQL, against SQLite."""
+import json
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pytest
+
+from activity_store import REPORT, START, UPLOAD, SQLiteActivityStore
+
+DAY1 = datetime(2026, 9, 1, 10, 0, 0)
+DAY2 = datetime(2026, 9, 2, 9, 30, 0)
+DAY3 = datetime(2026, 9, 3, 0, 0, 0)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteActivityStore(str(tmp_path / "activity.db"))
+    store.setup()
+    return store
+
+
+def test_flush_adds_usage_counts(store):
+    store.record("alice", "998900000001", DAY1)
+    store.record("alice", when=DAY1)
+    store.flush()
+    store.record("alice", when=DAY2)
+    store.record("bob", when=DAY2)
+    assert store.flush() == 2
+
+    # The count adds up across flushes, the phone number is kept and last use moves on
+    assert list(store.iter_users()) == [
+        ("alice", 3, "998900000001", "2026-09-02 09:30:00"),
+        ("bob", 1, None, "2026-09-02 09:30:00"),
+    ]
+
+
+def test_failed_flush_keeps_the_batch(store):
+    store.record("alice", "998900000001", DAY1)
+    store.record_event("alice", UPLOAD, DAY1)
+    working = store._connection
+
+    @contextmanager
+    def broken():
+        raise RuntimeError("database is down")
+        yield
+
+    store._connection = broken
+    with pytest.raises(RuntimeError):
+        store.flush()
+    # Recorded while the flush was failing; goes after the batch put back
+    store.record("alice", when=DAY2)
+
+    store._connection = working
+    assert store.flush() == 3
+    assert list(store.iter_users()) == [("alice", 2, "998900000001", "2026-09-02 09:30:00")]
+    assert list(store.iter_events()) == [
+        ("2026-09-01 10:00:00", "alice", START),
+        ("2026-09-01 10:00:00", "alice", UPLOAD),
+        ("2026-09-02 09:30:00", "alice", START),
+    ]
+
+
+def test_daily_rollup_adds_up_across_flushes(store):
+    store.record_event("alice", UPLOAD, DAY1)
+    store.record_event("bob", UPLOAD, DAY1)
+    store.flush()
+    store.record_event("alice", UPLOAD, DAY1.replace(hour=18))
+    store.record_event("alice", REPORT, DAY2)
+    store.flush()
+
+    assert list(store.iter_daily()) == [("2026-09-01", UPLOAD, 3), ("2026-09-02", REPORT, 1)]
+    assert list(store.iter_user_totals()) == [("alice", REPORT, 1), ("alice", UPLOAD, 2), ("bob", UPLOAD, 1)]
+
+
+def test_ranges_include_start_and_exclude_end(store):
+    for when in (DAY1, DAY2, DAY3):
+        store.record_event("alice", UPLOAD, when)
+    store.flush()
+
+    assert [row[0] for row in store.iter_events(DAY1, DAY3)] == ["2026-09-01 10:00:00", "2026-09-02 09:30:00"]
+    assert [row[0] for row in store.iter_events(DAY2)] == ["2026-09-02 09:30:00", "2026-09-03 00:00:00"]
+    assert [row[0] for row in store.iter_daily(date(2026, 9, 2), date(2026, 9, 3))] == ["2026-09-02"]
+    assert list(store.iter_user_totals(end=date(2026, 9, 2))) == [("alice", UPLOAD, 1)]
+
+
+def test_username_filters(store):
+    store.record("alice", when=DAY1)
+    store.record("bob", when=DAY2)
+    store.record_event("bob", UPLOAD, DAY2)
+    store.flush()
+
+    assert [row[0] for row in store.iter_users(username="bob")] == ["bob"]
+    assert list(store.iter_events(username="alice")) == [("2026-09-01 10:00:00", "alice", START)]
+    assert list(store.iter_daily(username="bob")) == [("2026-09-02", START, 1), ("2026-09-02", UPLOAD, 1)]
+    assert list(store.iter_user_totals(username="bob")) == [("bob", START, 1), ("bob", UPLOAD, 1)]
+    assert list(store.iter_user_totals(username="carol")) == []
+
+
+def test_migrate_json(store, tmp_path):
+    store.record("alice", "998900000001", DAY2)
+    store.flush()
+    path = tmp_path / "user_activity.json"
+    path.write_text(json.dumps({
+        "alice": {"usage_count": 7, "phone_number": "998900000009", "last_used": "2026-01-01 00:00:00"},
+        "bob": {"usage_count": 4, "phone_number": "998900000002", "last_used": "2026-08-31 12:00:00"},
+        "carol": {"usage_count": 1},
+    }))
+
+    assert store.migrate_json(str(path)) == 3
+    assert not path.exists() and (tmp_path / "user_activity.json.migrated").exists()
+    assert store.migrate_json(str(path)) == 0
+    # Users already in the store keep their data; users never seen have no last use to list
+    assert list(store.iter_users()) == [
+        ("bob", 4, "998900000002", "2026-08-31 12:00:00"),
+        ("alice", 1, "998900000001", "2026-09-02 09:30:00"),
+    ]
+
+
+def test_bot_state(store):
+    store.save_state("user_data", "42", b"first")
+    store.save_state("user_data", "42", b"second")
+    store.save_state("conversation:orders", "[42, 42]", b"state")
+
+    assert store.load_state("user_data") == {"42": b"second"}
+    assert store.load_state_value("user_data", "42") == b"second"
+    store.save_state("user_data", "42", None)
+    assert store.load_state_value("user_data", "42") is None
+    assert store.load_state("conversation:orders") == {"[42, 42]": b"state"}
@@ -0,0 +1,85 @@
+"""Sales history: snapshots of different warehouses never mix."""
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+from history import HistoryStore
+from ingest import read_export_with_warehouse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from generate_export import generate_export  # noqa: E402
+
+TODAY = date(2026, 10, 1)
+
+
+def export(sales: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Артикул ': [100001.0, 'A-2'][:len(sales)],
+        'Средние продажи день': sales,
+        'Остаток на конец': [10.0] * len(sales),
+    })
+
+
+def test_forecast_uses_own_source(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for offset in range(14):
+        day = TODAY - timedelta(days=offset)
+        store.record(export([1.0, 2.0]), f"a{offset}", "warehouse A", day)
+        store.record(export([9.0]), f"b{offset}", "warehouse B", day)
+
+    data = export([5.0, 5.0]).assign(**{'Артикул ': [100001, 'A-2']})
+    demand, known = store.forecast(data, 30, "warehouse A", TODAY)
+    assert known.tolist() == [True, True]
+    np.testing.assert_allclose(demand, [1.0, 2.0])
+
+    demand, known = store.forecast(data, 30, "warehouse B", TODAY)
+    assert known.tolist() == [True, False]
+    np.testing.assert_allclose(demand[:1], [9.0])
+    assert len(store.days()) == 14
+
+
+def test_same_day_keeps_last_snapshot(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    first = store.record(export([1.0]), "first", "warehouse A", TODAY)
+    os.utime(first, (time.time() - 60, time.time() - 60))
+    store.record(export([3.0]), "second", "warehouse A", TODAY)
+    sales = store.sales([TODAY], pd.Index(['100001']), "warehouse A")
+    assert sales.tolist() == [[3.0]]
+
+
+def test_same_named_exports_of_different_warehouses_stay_apart(tmp_path):
+    # The same default 1C file name for two warehouses, as in one zip of wh1/ and wh2/
+    paths = {}
+    for seed, warehouse in enumerate(["Склад Север", "Склад Юг"], start=1):
+        os.makedirs(tmp_path / f"wh{seed}")
+        paths[warehouse] = str(tmp_path / f"wh{seed}" / "Остатки.xlsx")
+        generate_export(paths[warehouse], 200, seed=seed, warehouse=warehouse)
+
+    history = str(tmp_path / "history")
+    for offset in range(14):
+        for path in paths.values():
+            pipeline.record_snapshot(path, TODAY - timedelta(days=offset), history)
+
+    store = HistoryStore(history)
+    for warehouse, path in paths.items():
+        data, found = read_export_with_warehouse(path)
+        assert found == warehouse
+        forecast, known = store.forecast_export(data, 30, found, TODAY)
+        assert known == len(data)
+        np.testing.assert_allclose(forecast['Средние продажи день'], data['Средние продажи день'], rtol=1e-6)
+
+
+def test_export_without_warehouse_needs_one(tmp_path):
+    path = str(tmp_path / "export.xlsx")
+    generate_export(path, 50, warehouse="")
+    with pytest.raises(ValueError, match="Склад"):
+        pipeline.record_snapshot(path, TODAY, str(tmp_path / "history"))
+    snapshot = pipeline.record_snapshot(path, TODAY, str(tmp_path / "history"), warehouse="Основной склад")
+    assert "source=Основной_склад" in snapshot
@@ -0,0 +1,59 @@
+"""read_export against clean_export(pd.read_excel(...)), which it replaced for uploads."""
+import os
+import sys
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from ingest import read_export
+from orders import clean_export
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from generate_export import COLUMNS, generate_export  # noqa: E402
+
+PREAMBLE = [['Склад: Основной склад'], ['Период: 01.01.2024 - 31.12.2024']]
+FOOTER = [['Итого', None, None, None, 10, 20.0, 30.0], ['Ответственный: ____________']]
+
+
+def workbook(header, rows) -> BytesIO:
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    output = BytesIO()
+    book.save(output)
+    output.seek(0)
+    return output
+
+
+def sku(i: int, stock=12.0) -> list:
+    return [100000 + i, f'Ламинат Дуб арт.{i}', 'м2', 0, 0, 0, stock, 0.5, '1 234', '∞', '01.01.2024']
+
+
+def assert_same_as_pandas(source: BytesIO) -> None:
+    expected = clean_export(pd.read_excel(BytesIO(source.getvalue())))
+    pd.testing.assert_frame_equal(read_export(BytesIO(source.getvalue())), expected)
+
+
+def test_matches_read_excel_on_generated_export():
+    output = BytesIO()
+    generate_export(output, 3000)
+    assert_same_as_pandas(output)
+
+
+def test_matches_read_excel_with_blank_rows_before_footer():
+    # Blank rows inside the body count as data, as pd.read_excel keeps them
+    rows = [sku(i) for i in range(5)] + [[None] * len(COLUMNS)] + [sku(i) for i in range(5, 8)] + [[], []]
+    assert_same_as_pandas(workbook(COLUMNS, PREAMBLE + rows + FOOTER))
+
+
+@pytest.mark.parametrize("body", [0, 1])
+def test_matches_read_excel_with_fewer_rows_than_preamble_and_footer(body):
+    rows = (PREAMBLE + [sku(i) for i in range(body)])[:3]
+    source = workbook(COLUMNS, rows)
+    assert_same_as_pandas(source)
+    assert read_export(source).empty
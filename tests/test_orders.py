@@ -0,0 +1,74 @@
+"""compute_orders against the row-by-row .loc loop it replaced, and batch consolidation."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from orders import compute_orders, consolidate_orders
+
+
+def reference_orders(data: pd.DataFrame, days: int, is_laminate: bool, percentage: float) -> pd.DataFrame:
+    """The original per-row calculation from the bot, kept as the reference."""
+    data1 = data.copy()
+    data1['Общый продажи период'] = data1['Средние продажи день'] * days
+    data1['helper'] = 0.0
+    data1['overstock'] = 0.0
+    data1['outofstock'] = 0.0  # Was 0; newer pandas refuses to put floats into an int column
+    if is_laminate:
+        data1['Общый продажи период'] = data1['Средние продажи день'] * days * percentage
+
+    for i, value in enumerate(data1['Дней на распродажи']):
+        if value <= days and value >= 0:
+            data1.loc[i, 'helper'] = float(data1.loc[i, 'Общый продажи период'] - data1.loc[i, 'Остаток на конец'])
+        else:
+            data1.loc[i, 'helper'] = 0
+            data1.loc[i, 'overstock'] = float(data1.loc[i, 'Остаток на конец'] - data1.loc[i, 'Общый продажи период'])
+
+    for i, value in enumerate(data1['Остаток на конец']):
+        if value <= 50:
+            data1.loc[i, 'outofstock'] = data1.loc[i, 'Прошло дней от последней продажи'] * data1.loc[i, 'Средние продажи день'] * percentage - data1.loc[i, 'Остаток на конец']
+    return data1
+
+
+@pytest.fixture(scope="module")
+def export():
+    """A cleaned export with the edge cases: '∞' days (-1), days on the period boundary, stock of exactly 50."""
+    rng = np.random.default_rng(0)
+    rows = 500
+    days_to_sell = rng.integers(-1, 200, rows)
+    days_to_sell[:4] = [-1, 0, 30, 31]
+    stock = rng.gamma(1.5, 60, rows).round(0)
+    stock[4:7] = [50, 50.5, 0]
+    return pd.DataFrame({
+        'Артикул ': np.arange(100000, 100000 + rows),
+        'Номенклатура': [f"Ламинат {i}" for i in range(rows)],
+        'Дней на распродажи': days_to_sell,
+        'Остаток на конец': stock,
+        'Средние продажи день': np.where(rng.random(rows) < 0.15, 0, rng.gamma(1.2, 1.5, rows)).round(3),
+        'Прошло дней от последней продажи': rng.integers(-1, 2000, rows),
+    })
+
+
+@pytest.mark.parametrize("days", [0, 7, 30, 90])
+@pytest.mark.parametrize("is_laminate, percentage", [(False, 1), (False, 0.8), (True, 1), (True, 0.65)])
+def test_compute_orders_matches_loop(export, days, is_laminate, percentage):
+    expected = reference_orders(export, days, is_laminate, percentage)
+    result = compute_orders(export, days, is_laminate, percentage)
+    for column in ['Общый продажи период', 'helper', 'overstock', 'outofstock']:
+        np.testing.assert_array_equal(result[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float), err_msg=column)
+
+
+def test_compute_orders_leaves_input_unchanged(export):
+    before = export.copy()
+    compute_orders(export, 30, True, 0.5)
+    pd.testing.assert_frame_equal(export, before)
+
+
+def test_consolidate_orders_matches_article_keys():
+    def order(articles, quantities):
+        return pd.DataFrame({'Артикул ': articles, 'Номенклатура': 'Товар', 'Коллекция': 'Aqua',
+                             'Рекомендательный Заказ': quantities})
+
+    consolidated = consolidate_orders({'A': order([100001.0, 'X-1'], [1.0, 2.0]), 'B': order([100001, ' X-1'], [3.0, 4.0])})
+    assert consolidated['Артикул '].tolist() == [100001.0, 'X-1']
+    assert isinstance(consolidated['Артикул '][0], float)  # Still a number in 'Сводный Заказ'
+    assert consolidated['Итого'].tolist() == [4.0, 6.0]
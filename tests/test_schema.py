@@ -0,0 +1,37 @@
+"""The export schema: header aliases, missing columns and malformed numbers, through read_export."""
+import pytest
+
+from ingest import read_export
+from schema import EXPORT_SCHEMA, SchemaError, match_header
+from test_ingest import COLUMNS, FOOTER, PREAMBLE, sku, workbook
+
+
+def test_accepts_header_aliases():
+    header = ['Артикул', 'Наименование', 'Конечный остаток', 'Средние продажи в день',
+              'Дней на распродажу', 'Дней от последней продажи']
+    rows = [[article, name, stock, sales, days, since] for article, name, *_, stock, sales, days, since, _ in
+            (sku(i) for i in range(3))]
+    data = read_export(workbook(header, PREAMBLE + rows + FOOTER))
+    assert list(data.columns) == ['Артикул ', 'Номенклатура', 'Дней на распродажи', 'Остаток на конец',
+                                  'Средние продажи день', 'Прошло дней от последней продажи']
+    assert data['Артикул '].tolist() == [100000, 100001, 100002]
+    assert data['Дней на распродажи'].tolist() == [1234] * 3
+
+
+def test_missing_columns_raise_schema_error():
+    header = [name for name in COLUMNS if name not in ('Номенклатура', 'Остаток на конец')]
+    with pytest.raises(SchemaError) as error:
+        read_export(workbook(header, PREAMBLE + FOOTER))
+    assert error.value.missing == ['Номенклатура', 'Остаток на конец']
+
+
+def test_non_number_names_its_column():
+    rows = [sku(0), sku(1, stock='двенадцать')]
+    with pytest.raises(ValueError, match="Остаток на конец"):
+        read_export(workbook(COLUMNS, PREAMBLE + rows + FOOTER))
+
+
+def test_match_header_ignores_case_spacing_and_yo():
+    header = ['  артикул', 'НОМЕНКЛАТУРА', 'Дней на  распродажи', 'Остаток на конец', 'Средние продажи день',
+              'Прошло дней от последней продажи']
+    assert match_header(header, EXPORT_SCHEMA) == [0, 1, 2, 3, 4, 5]
@@ -0,0 +1,247 @@
+"""The bot in webhook mode, end to end against the fake Bot API server in fake_telegram.py."""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+from fake_telegram import FakeTelegram
+
+pytest.importorskip("tornado")  # run_webhook needs python-telegram-bot[webhooks]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from generate_export import generate_export  # noqa: E402
+
+SECRET = "test-secret"
+USER = {"id": 42, "is_bot": False, "first_name": "Test", "username": "tester"}
+CHAT = {"id": 42, "type": "private", "first_name": "Test"}
+PHONE = "998916919534"  # One of main.ALLOWED_NUMBERS
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def message(**fields) -> dict:
+    return {"message": {"message_id": int(time.time() * 1000) % 10**6, "date": int(time.time()),
+                        "chat": CHAT, "from": USER, **fields}}
+
+
+def command(name: str) -> dict:
+    return message(text=f"/{name}", entities=[{"type": "bot_command", "offset": 0, "length": len(name) + 1}])
+
+
+def document(file_id: str) -> dict:
+    return message(document={"file_id": file_id, "file_unique_id": f"u-{file_id}",
+                             "file_name": f"{file_id}.xlsx", "file_size": 1})
+
+
+def button(data: str) -> dict:
+    return {"callback_query": {"id": str(time.time()), "from": USER, "chat_instance": "test", "data": data,
+                               "message": {"message_id": 1, "date": int(time.time()), "chat": CHAT, "text": "?"}}}
+
+
+class Bot:
+    """main.py run as a webhook server in a subprocess, with its state under `directory`."""
+
+    def __init__(self, telegram: FakeTelegram, directory, **env):
+        self.telegram = telegram
+        self.directory = directory
+        self.port = free_port()
+        self.log_path = directory / f"bot-{self.port}.log"
+        self.update_id = 0
+        self.process = None
+        self.env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+        self.env.update({
+            "TELEGRAM_TOKEN": "123:test",
+            "TELEGRAM_API_URL": telegram.url,
+            "WEBHOOK_URL": f"http://127.0.0.1:{self.port}",
+            "WEBHOOK_SECRET": SECRET,
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "PORT": str(self.port),
+            "ACTIVITY_DB": str(directory / "activity.db"),
+            "SESSION_DIR": str(directory / "sessions"),
+            "HISTORY_DIR": str(directory / "history"),
+            "METRICS_PORT": "0",
+            "PERSISTENCE_INTERVAL": "1",
+            **env,
+        })
+
+    def start(self) -> None:
+        webhooks = self.telegram.count("setWebhook")
+        self.log = open(self.log_path, "ab")
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], cwd=self.directory,
+                                        env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 60
+        while self.telegram.count("setWebhook") == webhooks or not self._listening():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                raise AssertionError(f"Bot did not start:\n{self.log_path.read_text()}")
+            time.sleep(0.1)
+
+    def stop(self) -> None:
+        # SIGTERM lets PTB shut down cleanly, which writes pending state to the persistence
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait(timeout=60)
+        self.log.close()
+
+    def send(self, update: dict) -> None:
+        self.update_id += 1
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{self.port}/telegram", json.dumps({"update_id": self.update_id, **update}).encode(),
+            {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            assert response.status == 200
+
+    def _listening(self) -> bool:
+        with socket.socket() as sock:
+            return sock.connect_ex(("127.0.0.1", self.port)) == 0
+
+
+@pytest.fixture
+def telegram():
+    server = FakeTelegram().start()
+    export = BytesIO()
+    generate_export(export, 300)
+    server.files["export"] = export.getvalue()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def bot(telegram, tmp_path):
+    bot = Bot(telegram, tmp_path)
+    bot.start()
+    yield bot
+    if bot.process.poll() is None:
+        bot.stop()
+
+
+@pytest.fixture
+def bots(telegram, tmp_path):
+    """Two bot processes sharing the database and the session directory."""
+    bots = [Bot(telegram, tmp_path, SHARED_STATE="1") for _ in range(2)]
+    for bot in bots:
+        bot.start()
+    yield bots
+    for bot in bots:
+        if bot.process.poll() is None:
+            bot.stop()
+
+
+def settle() -> None:
+    # Handlers reply just before they return; until then a non-blocking one keeps the user
+    # "still processing" (ConversationHandler.WAITING), and with SHARED_STATE the new state
+    # is not yet in the database for the other process
+    time.sleep(0.5)
+
+
+def sign_in(bot: Bot, telegram: FakeTelegram) -> None:
+    bot.send(command("start"))
+    telegram.wait_for("sendMessage", "поделитесь своим номером")
+    bot.send(message(contact={"phone_number": PHONE, "first_name": "Test", "user_id": USER["id"]}))
+    telegram.wait_for("sendMessage", "Доступ предоставлен")
+
+
+def test_report_over_webhook(bot, telegram):
+    sign_in(bot, telegram)
+    bot.send(document("export"))
+    telegram.wait_for("sendMessage", "количество дней")
+    settle()
+    bot.send(message(text="30"))
+    telegram.wait_for("sendMessage", "Ламинат?")
+    bot.send(button("no"))
+
+    report = telegram.wait_for("sendDocument")
+    workbook = openpyxl.load_workbook(BytesIO(report["document"]), read_only=True)
+    assert workbook.sheetnames[0] == "Рекомендательный Заказ"
+
+
+def test_rejects_wrong_secret(bot):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{bot.port}/telegram", json.dumps({"update_id": 1, **command("start")}).encode(),
+        {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": "wrong"},
+    )
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=10)
+    assert error.value.code == 403
+
+
+def test_conversation_survives_restart(bot, telegram):
+    sign_in(bot, telegram)
+    bot.stop()
+    bot.start()
+    # Only an active conversation (restored from the database) accepts a file without /start
+    bot.send(document("export"))
+    telegram.wait_for("sendMessage", "количество дней")
+
+
+def test_cancel_while_processing(bot, telegram):
+    # Large enough to still be processing when the next updates arrive
+    export = BytesIO()
+    generate_export(export, 30000)
+    telegram.files["large"] = export.getvalue()
+    sign_in(bot, telegram)
+    bot.send(document("large"))
+    bot.send({"edited_message": message(text="?")["message"]})
+    telegram.wait_for("sendMessage", "ещё обрабатывается")
+    bot.send(command("cancel"))
+    telegram.wait_for("sendMessage", "Процесс отменен")
+
+    # The stopped upload neither asks for the days nor keeps the conversation going
+    bot.send(message(text="30"))
+    settle()
+    texts = [str(params.get("text", "")) for method, params in telegram.calls if method == "sendMessage"]
+    assert not any("количество дней" in text for text in texts)
+    bot.send(command("start"))
+    telegram.wait_for("sendMessage", "поделитесь своим номером")
+
+
+def test_processes_share_a_conversation(bots, telegram):
+    first, second = bots
+    sign_in(first, telegram)
+    settle()
+    second.send(document("export"))
+    telegram.wait_for("sendMessage", "количество дней")
+    settle()
+    first.send(message(text="30"))
+    telegram.wait_for("sendMessage", "Ламинат?")
+    settle()
+    # The upload waits in the shared session directory for whichever process gets the answer
+    second.send(button("no"))
+
+    report = telegram.wait_for("sendDocument")
+    workbook = openpyxl.load_workbook(BytesIO(report["document"]), read_only=True)
+    assert workbook.sheetnames[0] == "Рекомендательный Заказ"
+
+
+def test_processes_share_a_batch(bots, telegram):
+    other = BytesIO()
+    generate_export(other, 300, seed=1)
+    telegram.files["other"] = other.getvalue()
+    first, second = bots
+    sign_in(first, telegram)
+    settle()
+    second.send(command("batch"))
+    telegram.wait_for("sendMessage", "Пакетная обработка")
+    settle()
+    first.send(document("export"))
+    telegram.wait_for("sendMessage", "Файлов получено: 1")
+    settle()
+    second.send(document("other"))
+    telegram.wait_for("sendMessage", "Файлов получено: 2")
+    settle()
+    first.send(command("done"))
+    telegram.wait_for("sendMessage", "Файлов к обработке: 2")
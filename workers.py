@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import measure_call
+
+logger = logging.getLogger(__name__)
+
+# "thread" or "process"; processes avoid the GIL for pandas-heavy jobs at the cost of pickling frames
+WORKER_POOL = os.environ.get("WORKER_POOL", "thread")
+# Maximum number of heavy jobs (parsing, calculation, workbook build) running at the same time
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 2))
+# Share of process-pool jobs whose peak memory is traced (tracemalloc slows a job down)
+MEMORY_SAMPLE_RATE = float(os.environ.get("MEMORY_SAMPLE_RATE", 0.1))
+
+
+class JobQueue:
+    """Run CPU-bound jobs in a worker pool, at most `max_workers` at a time.
+
+    Jobs over the limit wait in FIFO order; callers may pass a `notify` coroutine
+    function that is awaited with the job's queue position before it starts waiting.
+    With a metrics `span`, the job is timed inside the worker and the time spent
+    queued is kept separately. In a process pool the span's RSS is the worker's, and
+    since a worker runs one job at a time `memory_sample_rate` of the jobs also report
+    their tracemalloc peak; threads share the bot's process, so thread jobs keep the
+    RSS the span measures itself and report no peak.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, pool: str = WORKER_POOL,
+                 memory_sample_rate: float = MEMORY_SAMPLE_RATE):
+        self._processes = pool == "process"
+        self.memory_sample_rate = memory_sample_rate if self._processes else 0.0
+        if pool == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._slots = asyncio.Semaphore(max_workers)
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    async def run(self, func, *args, notify=None, span=None):
+        queued = time.perf_counter()
+        if self._slots.locked():
+            self._waiting += 1
+            try:
+                if notify is not None:
+                    await notify(self._waiting)
+                await self._slots.acquire()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        try:
+            loop = asyncio.get_running_loop()
+            if span is None:
+                return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+            span.wait_seconds = time.perf_counter() - queued
+            trace_memory = random.random() < self.memory_sample_rate
+            result, span.seconds, rss, span.peak_memory = await loop.run_in_executor(
+                self._executor, functools.partial(measure_call, func, *args, trace_memory=trace_memory)
+            )
+            if self._processes:
+                span.rss = rss
+            return result
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)